@@ -0,0 +1,329 @@
+"""
+Micro-benchmarks for filesystem.py
+
+    python bench_filesystem.py            # run every benchmark
+    python bench_filesystem.py ring       # run selected benchmarks by name
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from filesystem import (
+    CODECS, ConsistentHasher, DistributedFileSystem, DiskStorage, FileMetadata, LocalCluster,
+    PackStorage, looks_compressible
+)
+
+# ======================
+# Consistent Hashing
+# ======================
+
+def bench_ring(lookups=20_000):
+    keys = [f"/data/dir_{i % 97}/file_{i}.txt" for i in range(lookups)]
+    print(f"{'nodes':>6} {'get_node us/op':>16} {'bulk us/op':>12}")
+
+    for node_count in (1, 16, 256):
+        hasher = ConsistentHasher([f"node-{i}" for i in range(node_count)])
+
+        start = time.perf_counter()
+        for key in keys:
+            hasher.get_node(key)
+        single = (time.perf_counter() - start) / lookups * 1e6
+
+        start = time.perf_counter()
+        hasher.get_nodes_bulk(keys)
+        bulk = (time.perf_counter() - start) / lookups * 1e6
+
+        print(f"{node_count:>6} {single:>16.2f} {bulk:>12.2f}")
+
+def bench_cluster(files=2000, file_size=64 * 1024, node_counts=(1, 2, 4, 8)):
+    """Client batch throughput against 1-8 node processes on loopback"""
+    payloads = {f"/bench/f{i}": (f"row {i} ".encode() * file_size)[:file_size] for i in range(files)}
+    print(f"{'nodes':>6} {'write files/s':>14} {'read files/s':>13}")
+
+    for nodes in node_counts:
+        with LocalCluster(nodes) as cluster:
+            client = cluster.client()
+            client.mkdir("/bench")
+
+            start = time.perf_counter()
+            client.add_files(payloads)
+            write_rate = files / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            client.read_files(list(payloads))
+            read_rate = files / (time.perf_counter() - start)
+
+            print(f"{nodes:>6} {write_rate:>14,.0f} {read_rate:>13,.0f}")
+            client.close()
+
+# ======================
+# Concurrency
+# ======================
+
+def bench_concurrent_reads(files=64, reads=2000, file_size=256 * 1024):
+    """Read throughput by thread count, with and without a global read lock.
+
+    Files are compressible and on DiskStorage, so the per-read work is
+    file I/O and zlib, both of which release the GIL.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        fs = DistributedFileSystem(storage_backend=DiskStorage(base_path=tmp))
+        fs.mkdir("/bench")
+        for i in range(files):
+            fs.add_file(f"/bench/f{i}", (f"row {i} ".encode() * file_size)[:file_size])
+
+        serial = threading.Lock()
+
+        def serialized_read(path):
+            with serial:  # models the old single RLock around every read
+                return fs.read_file(path)
+
+        paths = [f"/bench/f{i % files}" for i in range(reads)]
+        print(f"{'threads':>8} {'global lock ops/s':>18} {'rw lock ops/s':>14}")
+        for threads in (1, 2, 4, 8):
+            row = []
+            for read in (serialized_read, fs.read_file):
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    start = time.perf_counter()
+                    list(executor.map(read, paths))
+                    row.append(reads / (time.perf_counter() - start))
+            print(f"{threads:>8} {row[0]:>18,.0f} {row[1]:>14,.0f}")
+
+# ======================
+# Directories
+# ======================
+
+def bench_large_directory(entries=200_000, rounds=20):
+    """Insert-then-list cycles and paged listing in one huge directory"""
+    print(f"{'layout':>8} {'fill s':>8} {'insert+list ms':>15} {'100-name page ms':>17}")
+    for layout, threshold in (('plain', entries * 2), ('sharded', 1000)):
+        fs = DistributedFileSystem(shard_threshold=threshold)
+        fs.mkdir("/big")
+
+        start = time.perf_counter()
+        fs.add_files({f"/big/f{i:07d}": b"x" for i in range(entries)})
+        fill = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(rounds):
+            fs.add_file(f"/big/new_{i}", b"y")
+            fs.list_dir("/big")
+        cycle = (time.perf_counter() - start) / rounds * 1e3
+
+        start = time.perf_counter()
+        for i in range(rounds):
+            fs.list_dir("/big", start_after=f"f{i * 9973:07d}", limit=100)
+        page = (time.perf_counter() - start) / rounds * 1e3
+        print(f"{layout:>8} {fill:>8.2f} {cycle:>15.2f} {page:>17.3f}")
+
+def bench_walk(dirs=200, files_per_dir=1000):
+    """Full-tree scan: list_dir plus a lookup per entry vs one walk()"""
+    fs = DistributedFileSystem()
+    for d in range(dirs):
+        fs.mkdir(f"/d{d:03d}")
+    fs.add_files({f"/d{d:03d}/f{i:04d}.log": b"x" for d in range(dirs) for i in range(files_per_dir)})
+    total = dirs * files_per_dir
+
+    def scan_with_list_dir(path="/"):
+        found = 0
+        for name in fs.list_dir(path):
+            child = f"{path.rstrip('/')}/{name}"
+            node = fs._resolve_path(child)
+            found += scan_with_list_dir(child) if node is not None and hasattr(node, 'children') else 1
+        return found
+
+    print(f"{'method':>10} {'entries/s':>12}")
+    for label, scan in (('list_dir', scan_with_list_dir), ('walk', lambda: sum(1 for _ in fs.walk()))):
+        fs.path_cache.clear()
+        start = time.perf_counter()
+        assert scan() == total
+        print(f"{label:>10} {total / (time.perf_counter() - start):>12,.0f}")
+
+def bench_dedup(dirs=100, files_per_dir=1000, distinct=5000):
+    """Dedup accounting and duplicate lookup: full walk() vs the content index"""
+    fs = DistributedFileSystem(inline_threshold=0)
+    for d in range(dirs):
+        fs.mkdir(f"/d{d:03d}")
+    fs.add_files({f"/d{d:03d}/f{i:04d}": b"%08d" % ((d * files_per_dir + i) % distinct)
+                  for d in range(dirs) for i in range(files_per_dir)})
+    probe = fs._resolve_path("/d000/f0000").content_hash
+
+    def scan_with_walk():
+        unique, logical, matches = {}, 0, []
+        for path, meta in fs.walk():
+            unique[meta.digest] = meta.size
+            logical += meta.size
+            if meta.content_hash == probe:
+                matches.append(path)
+        return logical - sum(unique.values()), matches
+
+    def scan_with_index():
+        return fs.dedup_stats()['bytes_saved'], fs.paths_for_hash(probe)
+
+    print(f"{'method':>8} {'seconds':>10}")
+    results = []
+    for label, scan in (('walk', scan_with_walk), ('index', scan_with_index)):
+        start = time.perf_counter()
+        results.append(scan())
+        print(f"{label:>8} {time.perf_counter() - start:>10.5f}")
+    assert results[0] == results[1]
+
+# ======================
+# Storage Backends
+# ======================
+
+def bench_storage_backends(blobs=100_000, blob_size=4096):
+    """Write then read back many small blobs on DiskStorage vs PackStorage"""
+    payloads = [os.urandom(blob_size) for _ in range(blobs)]
+    print(f"{'backend':>8} {'write blobs/s':>14} {'read blobs/s':>13} {'files':>8}")
+
+    for name, make in (('disk', DiskStorage), ('pack', PackStorage)):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = make(base_path=tmp)
+
+            start = time.perf_counter()
+            hashes = [storage.write(data) for data in payloads]
+            if hasattr(storage, 'flush'):
+                storage.flush()
+            write_rate = blobs / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for content_hash in hashes:
+                storage.read(content_hash)
+            read_rate = blobs / (time.perf_counter() - start)
+
+            files = sum(len(f) for _, _, f in os.walk(tmp))
+            print(f"{name:>8} {write_rate:>14,.0f} {read_rate:>13,.0f} {files:>8,}")
+            if hasattr(storage, 'close'):
+                storage.close()
+
+# ======================
+# Codecs
+# ======================
+
+def bench_codecs(size=8 * 1024 * 1024):
+    """Compress/decompress throughput and ratio per codec, plus sampling cost"""
+    text = b"".join(f"{i:08d},user_{i % 977},/data/dir_{i % 31}/file_{i}.txt,OK\n".encode()
+                    for i in range(size // 48))[:size]
+    random_data = os.urandom(size)
+    mb = size / 1e6
+
+    print(f"{'codec':>10} {'data':>7} {'comp MB/s':>10} {'decomp MB/s':>12} {'ratio':>6}")
+    for name, codec in CODECS.items():
+        for label, data in (('text', text), ('random', random_data)):
+            start = time.perf_counter()
+            packed = codec.compress(data)
+            comp = mb / (time.perf_counter() - start)
+            start = time.perf_counter()
+            codec.decompress(packed)
+            decomp = mb / (time.perf_counter() - start)
+            print(f"{name:>10} {label:>7} {comp:>10,.0f} {decomp:>12,.0f} {len(packed) / size:>6.2f}")
+
+    start = time.perf_counter()
+    looks_compressible(random_data)
+    print(f"sampled compressibility check on {mb:.0f} MB random: "
+          f"{(time.perf_counter() - start) * 1e3:.2f} ms")
+
+# ======================
+# Metadata Memory
+# ======================
+
+@dataclass
+class LegacyFileMetadata:
+    """The pre-slots node layout: per-instance __dict__ and a hex hash"""
+    content_hash: str
+    size: int
+    compressed: bool
+    created_at: float
+    modified_at: float
+    chunks: Optional[List[Tuple[str, int, bool]]] = None
+    codec: str = 'zlib'
+    inline: Optional[bytes] = None
+
+def _traced_bytes(build):
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        return tracemalloc.get_traced_memory()[0] - start, kept
+    finally:
+        tracemalloc.stop()
+
+def bench_metadata_memory(entries=200_000, dirs=100):
+    """Bytes per file entry: bare nodes, then whole trees with and without name interning"""
+    digests = [hashlib.sha256(str(i).encode()).digest() for i in range(entries)]
+    now = time.time()
+
+    print(f"{'layout':>14} {'bytes/entry':>12}")
+    for label, build in (
+        ('dict+hex', lambda: [LegacyFileMetadata(d.hex(), 4096, False, now, now) for d in digests]),
+        ('slots+digest', lambda: [FileMetadata(d, 4096, False, now, now) for d in digests]),
+    ):
+        used, _ = _traced_bytes(build)
+        print(f"{label:>14} {used / entries:>12.1f}")
+
+    # Every file shares one blob, so the tree's metadata is all that grows
+    files = {f"/d{i % dirs}/part-{i // dirs:05d}.parquet": b"x" for i in range(entries)}
+    for intern_names in (False, True):
+        fs = DistributedFileSystem(inline_threshold=0, intern_names=intern_names)
+        for i in range(dirs):
+            fs.mkdir(f"/d{i}")
+        used, _ = _traced_bytes(lambda: fs.add_files(files) or fs)
+        label = 'tree+intern' if intern_names else 'tree'
+        print(f"{label:>14} {used / entries:>12.1f}")
+
+# ======================
+# Restart
+# ======================
+
+def bench_restart(entries=200_000, tail=1000):
+    """Recovery time from a journal alone vs a snapshot plus a short tail"""
+    files = {f"/d{i % 100}/f{i}": b"x" for i in range(entries)}
+    print(f"{'state':>18} {'recover s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        fs = DistributedFileSystem(journal_path=tmp, snapshot_every=entries * 10)
+        for i in range(100):
+            fs.mkdir(f"/d{i}")
+        fs.add_files(files)
+
+        for label in ('journal only', f'snapshot+{tail}'):
+            if label != 'journal only':
+                fs.checkpoint()
+                for i in range(tail):
+                    fs.add_file(f"/d0/tail{i}", b"y")
+            fs.close()  # the journal directory admits one live instance
+            start = time.perf_counter()
+            fs = DistributedFileSystem(journal_path=tmp, snapshot_every=entries * 10)
+            print(f"{label:>18} {time.perf_counter() - start:>10.2f}")
+        fs.close()
+
+# ======================
+# Runner
+# ======================
+
+BENCHMARKS = {
+    'ring': bench_ring,
+    'cluster': bench_cluster,
+    'concurrent_reads': bench_concurrent_reads,
+    'large_directory': bench_large_directory,
+    'walk': bench_walk,
+    'dedup': bench_dedup,
+    'storage_backends': bench_storage_backends,
+    'codecs': bench_codecs,
+    'metadata_memory': bench_metadata_memory,
+    'restart': bench_restart,
+}
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
@@ -1,32 +1,64 @@
 import os
 import zlib
+import lzma
+import bz2
 import mmap
 import hashlib
+import hmac
+import ipaddress
+import struct
+import weakref
+import math
 import socket
+import sys
 import time
 import threading
-from dataclasses import dataclass
-from typing import Optional, Dict, List, Union
-from functools import lru_cache, cached_property
-from concurrent.futures import ThreadPoolExecutor
-from bisect import insort
+import heapq
+import fnmatch
+import re
+import builtins
+import marshal
+import multiprocessing
+from dataclasses import dataclass, field, replace
+from typing import Optional, Dict, List, Tuple, Union
+from functools import lru_cache, cached_property, wraps
+from concurrent.futures import Future, ThreadPoolExecutor
+from bisect import bisect_left, bisect_right, insort
 from collections import OrderedDict
+from collections.abc import MutableMapping
+from itertools import chain, count, groupby, islice
 from abc import ABC, abstractmethod
 
+try:
+    import fcntl
+    import resource
+except ImportError:  # not on Windows
+    fcntl = resource = None
+
 """
 Key Features Implemented
 
     Multi-Layer Storage
 
-        Memory and disk storage backends
+        Memory, disk and pack-file storage backends
 
         Content-addressable storage with deduplication
 
+        Reverse content-hash index with O(1) dedup accounting
+
+        Small files stored inline in their metadata
+
+        Reference-counted blobs with incremental garbage collection
+
+        Metadata write-ahead journal with binary snapshots for fast restart
+
     Advanced Caching
 
         Path resolution caching
 
-        Lazy directory sorting
+        Ordered, paginated directory listing
+
+        Incremental tree walk with in-lock filtering
 
         Smart cache invalidation
 
@@ -36,20 +68,30 @@ Key Features Implemented
 
         Node location awareness
 
-        Operation routing (stub implementation)
+        Operation routing over pooled, pipelined RPC connections
+
+        Local multi-process cluster harness
+
+        Minimal-movement rebalancing on ring membership changes
 
     Efficiency Optimizations
 
         Auto-compression with threshold
 
+        Pluggable codecs with sampled compressibility checks
+
         Background operations via ThreadPool
 
         Fine-grained locking
 
+        Slotted metadata nodes with binary digests and interned names
+
     Monitoring
 
         Operation statistics tracking
 
+        Thread-local latency histograms (p50/p99) and cache hit ratios
+
         Compression ratio metrics
 
         Shard creation tracking
@@ -61,142 +103,2216 @@ Key Features Implemented
 # Core Data Structures
 # ======================
 
-@dataclass
+@dataclass(slots=True)
 class FileMetadata:
-    content_hash: str
+    """Per-file node, slotted so a 10M-file tree carries no per-instance dicts.
+
+    The content hash is kept as its 32-byte SHA-256 digest (b'' when the
+    file is inline); content_hash gives the hex form the backends use.
+    """
+    digest: bytes
     size: int
     compressed: bool
     created_at: float
     modified_at: float
+    # (content_hash, raw_size, compressed) per chunk for streamed files
+    chunks: Optional[List[Tuple[str, int, bool]]] = None
+    codec: str = 'zlib'  # codec used for the compressed blobs or chunks
+    inline: Optional[bytes] = None  # small files live here, not in storage
+
+    @property
+    def content_hash(self) -> str:
+        return self.digest.hex()
+
+class SortedKeyList:
+    """Sorted list of names kept as bounded blocks.
+
+    Inserts bisect the block maxima and then one block of at most
+    2 * load names, so they stay O(log n) plus a small memmove.
+    """
+
+    def __init__(self, keys=(), load: int = 512):
+        self.load = load
+        keys = sorted(keys)
+        self.blocks = [keys[i:i + load] for i in range(0, len(keys), load)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(keys)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        return chain.from_iterable(self.blocks)
+
+    def add(self, key: str):
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+        else:
+            i = min(bisect_left(self.maxes, key), len(self.maxes) - 1)
+            block = self.blocks[i]
+            insort(block, key)
+            self.maxes[i] = block[-1]
+            if len(block) > 2 * self.load:
+                self.blocks[i:i + 1] = [block[:self.load], block[self.load:]]
+                self.maxes[i:i + 1] = [block[self.load - 1], block[-1]]
+        self.size += 1
+
+    def remove(self, key: str):
+        i = bisect_left(self.maxes, key)
+        block = self.blocks[i]
+        del block[bisect_left(block, key)]
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+        self.size -= 1
+
+    def irange(self, start_after: Optional[str] = None):
+        """Yield keys strictly greater than start_after, in order"""
+        if start_after is None:
+            yield from chain.from_iterable(self.blocks)
+            return
+        i = bisect_right(self.maxes, start_after)
+        if i == len(self.blocks):
+            return
+        block = self.blocks[i]
+        yield from map(block.__getitem__, range(bisect_right(block, start_after), len(block)))
+        yield from chain.from_iterable(map(self.blocks.__getitem__, range(i + 1, len(self.blocks))))
+
+class SortedChildren(MutableMapping):
+    """Directory children with name lookup and ordered iteration"""
+
+    def __init__(self, children: Dict[str, 'Node'] = None):
+        self.nodes = dict(children or {})
+        self.keys_in_order = SortedKeyList(self.nodes)
+
+    def __getitem__(self, name: str) -> 'Node':
+        return self.nodes[name]
+
+    def get(self, name: str, default=None):
+        return self.nodes.get(name, default)
+
+    def __contains__(self, name) -> bool:
+        return name in self.nodes
+
+    def __setitem__(self, name: str, node: 'Node'):
+        if name not in self.nodes:
+            self.keys_in_order.add(name)
+        self.nodes[name] = node
+
+    def __delitem__(self, name: str):
+        del self.nodes[name]
+        self.keys_in_order.remove(name)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.keys_in_order)
+
+    def items(self):
+        nodes = self.nodes
+        return ((name, nodes[name]) for name in self.keys_in_order)
+
+    def irange(self, start_after: Optional[str] = None):
+        return self.keys_in_order.irange(start_after)
+
+class ShardedChildren(MutableMapping):
+    """Children of a huge directory, split into sub-maps by name hash.
+
+    Lookups touch a single small shard. One sorted key list over every
+    name serves full and paged listings, so a page costs the same as in
+    an unsharded directory instead of merging every shard.
+    """
+
+    def __init__(self, children: Dict[str, 'Node'] = None, shard_count: int = 256):
+        self.shards = [{} for _ in range(shard_count)]
+        for name, node in (children or {}).items():
+            self.shards[self.shard_index(name)][name] = node
+        self.keys_in_order = SortedKeyList(children or ())
+
+    def shard_index(self, name: str) -> int:
+        return zlib.crc32(name.encode()) % len(self.shards)
+
+    def __getitem__(self, name: str) -> 'Node':
+        return self.shards[self.shard_index(name)][name]
+
+    def get(self, name: str, default=None):
+        return self.shards[self.shard_index(name)].get(name, default)
+
+    def __contains__(self, name) -> bool:
+        return name in self.shards[self.shard_index(name)]
+
+    def __setitem__(self, name: str, node: 'Node'):
+        shard = self.shards[self.shard_index(name)]
+        if name not in shard:
+            self.keys_in_order.add(name)
+        shard[name] = node
+
+    def __delitem__(self, name: str):
+        del self.shards[self.shard_index(name)][name]
+        self.keys_in_order.remove(name)
+
+    def __len__(self) -> int:
+        return len(self.keys_in_order)
+
+    def __iter__(self):
+        return iter(self.keys_in_order)
+
+    def irange(self, start_after: Optional[str] = None):
+        return self.keys_in_order.irange(start_after)
+
+@dataclass(slots=True)
+class DirectoryMetadata:
+    children: Union[SortedChildren, ShardedChildren] = field(default_factory=SortedChildren)
+    sharded: bool = False
+    shard_keys: List[str] = None
+
+Node = Union[FileMetadata, DirectoryMetadata]
+
+# ======================
+# Compression Codecs
+# ======================
+
+class Codec:
+    def __init__(self, name: str, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+CODECS: Dict[str, Codec] = {}
+
+def register_codec(codec: Codec):
+    """Make a codec selectable by name; its name is recorded per file"""
+    CODECS[codec.name] = codec
+
+for _codec in (
+    Codec('none', bytes, bytes),
+    Codec('zlib', zlib.compress, zlib.decompress),
+    Codec('zlib-fast', lambda data: zlib.compress(data, 1), zlib.decompress),
+    Codec('zlib-max', lambda data: zlib.compress(data, 9), zlib.decompress),
+    Codec('bz2', bz2.compress, bz2.decompress),
+    Codec('lzma', lzma.compress, lzma.decompress),
+):
+    register_codec(_codec)
+
+def looks_compressible(content: bytes, sample_size: int = 4096, ratio: float = 0.9) -> bool:
+    """Estimate compressibility from fast-compressed samples.
+
+    Payloads of up to four samples are always worth a real attempt;
+    larger ones are judged on their head, middle and tail.
+    """
+    size = len(content)
+    if size <= 4 * sample_size:
+        return True
+    samples = [content[i:i + sample_size] for i in (0, size // 2, size - sample_size)]
+    packed = sum(len(zlib.compress(sample, 1)) for sample in samples)
+    return packed < 3 * sample_size * ratio
+
+# ======================
+# Storage Backend Abstraction
+# ======================
+
+class StorageBackend(ABC):
+    @abstractmethod
+    def read(self, content_hash: str) -> bytes:
+        pass
+    
+    @abstractmethod
+    def write(self, data: bytes, content_hash: Optional[str] = None) -> str:
+        """Store data under its SHA-256, which callers may pass precomputed"""
+        pass
+    
+    @abstractmethod
+    def delete(self, content_hash: str) -> int:
+        """Remove a blob and return the number of bytes freed"""
+        pass
+
+    def read_range(self, content_hash: str, offset: int, length: int) -> memoryview:
+        """Read length bytes at offset; backends override to avoid a full read"""
+        return memoryview(self.read(content_hash))[offset:offset + length]
+
+    def list_hashes(self):
+        """Iterate the content hashes currently stored (used by the GC sweep).
+
+        Optional: a backend that cannot enumerate its blobs leaves this
+        out, and defragment() refuses to run on it.
+        """
+        raise NotImplementedError
+
+    def metadata_path(self) -> Optional[str]:
+        """Default home for the metadata journal; None if the backend is volatile"""
+        return None
+
+    def flush(self):
+        """Make every blob written so far durable; the journal calls this
+        before each group commit so no record names a blob a crash could lose"""
+        pass
+
+class MemoryStorage(StorageBackend):
+    def __init__(self):
+        self.store = {}
+        
+    def read(self, content_hash: str) -> bytes:
+        return self.store[content_hash]
+    
+    def write(self, data: bytes, content_hash: Optional[str] = None) -> str:
+        content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        self.store[content_hash] = data
+        return content_hash
+    
+    def delete(self, content_hash: str) -> int:
+        data = self.store.pop(content_hash, None)
+        return len(data) if data is not None else 0
+
+    def list_hashes(self):
+        return list(self.store)
+
+    def read_range(self, content_hash: str, offset: int, length: int) -> memoryview:
+        return memoryview(self.store[content_hash])[offset:offset + length]
+
+class DiskStorage(StorageBackend):
+    def __init__(self, base_path: str = "/tmp/fs_storage", max_mappings: Optional[int] = None):
+        self.base_path = base_path
+        self.max_mappings = max_mappings or self._default_max_mappings()
+        self.mappings = OrderedDict()  # content_hash -> mmap, LRU order
+        self.retired = []              # evicted mappings a caller's view still pins
+        self.mapping_lock = threading.Lock()
+        self.unsynced = set()          # blob paths written since the last flush
+        self.sync_lock = threading.Lock()
+        os.makedirs(base_path, exist_ok=True)
+        
+    def _get_path(self, content_hash: str) -> str:
+        return os.path.join(self.base_path, content_hash[:2], content_hash[2:4], content_hash)
+
+    def metadata_path(self) -> str:
+        return os.path.join(self.base_path, "meta")
+    
+    def read(self, content_hash: str) -> bytes:
+        with open(self._get_path(content_hash), 'rb') as f:
+            return f.read()
+
+    def read_view(self, content_hash: str) -> memoryview:
+        """Zero-copy view of a blob backed by a cached read-only mmap"""
+        return self._mapping(content_hash)
+
+    def read_range(self, content_hash: str, offset: int, length: int) -> memoryview:
+        return self.read_view(content_hash)[offset:offset + length]
+    
+    def write(self, data: bytes, content_hash: Optional[str] = None) -> str:
+        content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        path = self._get_path(content_hash)
+        if os.path.exists(path):
+            return content_hash
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Publish via rename so concurrent readers never see a partial blob
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.sync_lock:
+            self.unsynced.add(path)
+        return content_hash
+
+    def flush(self):
+        """fsync blobs written since the last flush, then the directories naming them"""
+        with self.sync_lock:
+            paths, self.unsynced = self.unsynced, set()
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue  # deleted since
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for directory in {os.path.dirname(path) for path in paths}:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+    
+    def delete(self, content_hash: str) -> int:
+        with self.mapping_lock:
+            mapped = self.mappings.pop(content_hash, None)
+            if mapped is not None:
+                self._release(mapped)
+        path = self._get_path(content_hash)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def list_hashes(self):
+        for top in os.scandir(self.base_path):
+            if not top.is_dir():
+                continue
+            for sub in os.scandir(top.path):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    if not entry.name.endswith('.tmp'):
+                        yield entry.name
+
+    @staticmethod
+    def _default_max_mappings() -> int:
+        """A quarter of the open-file soft limit, since every mmap holds its own fd"""
+        if resource is None:
+            return 256
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft == resource.RLIM_INFINITY:
+            return 1024
+        return max(16, min(1024, soft // 4))
+
+    def _mapping(self, content_hash: str) -> memoryview:
+        """View of the cached mapping for a blob, opening it on a miss.
+
+        Views are taken under the lock so eviction cannot close a mapping in
+        between. An evicted mapping is closed at once unless a caller still
+        holds a view; then it waits in retired until that view is released.
+        """
+        with self.mapping_lock:
+            mapped = self.mappings.get(content_hash)
+            if mapped is not None:
+                self.mappings.move_to_end(content_hash)
+                return memoryview(mapped)
+
+        with open(self._get_path(content_hash), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b'')
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        with self.mapping_lock:
+            cached = self.mappings.setdefault(content_hash, mapped)
+            if cached is not mapped:
+                mapped.close()  # lost the race to another reader
+            self.mappings.move_to_end(content_hash)
+            view = memoryview(cached)
+            if len(self.mappings) > self.max_mappings:
+                self.retired = [old for old in self.retired if not self._try_close(old)]
+                while len(self.mappings) > self.max_mappings:
+                    self._release(self.mappings.popitem(last=False)[1])
+        return view
+
+    def _release(self, mapped: mmap.mmap):
+        """Close a mapping dropped from the cache, or park it while views pin it (lock held)"""
+        if not self._try_close(mapped):
+            self.retired.append(mapped)
+
+    @staticmethod
+    def _try_close(mapped: mmap.mmap) -> bool:
+        try:
+            mapped.close()
+        except BufferError:  # exported views still reference it
+            return False
+        return True
+
+class PackStorage(StorageBackend):
+    """Blobs appended to large pack files instead of one file per blob.
+
+    An in-memory index maps each hash to (pack, offset, length) and is
+    persisted as an append-only index log next to the packs. Pack data
+    and index records are fsynced together every sync_every mutations
+    (group commit) or on flush(). Deleted blobs leave dead bytes behind
+    until compact() copies the live blobs out of mostly-dead packs.
+
+    Pack records and index records both reach the OS as they are
+    written. Each blob in a pack is preceded by its digest and length, so
+    on open every pack is scanned past its last indexed blob, recovering
+    blobs whose index record was lost, or the whole index if the log is.
+    """
+
+    RECORD = struct.Struct('<32sQ')          # digest, length
+    INDEX_ENTRY = struct.Struct('<B32sIQQ')  # op, digest, pack id, offset, length
+    ADD, DELETE, INDEXED = 1, 0, 2           # INDEXED: pack covered up to offset
+
+    def __init__(self, base_path: str = "/tmp/fs_packs", pack_size: int = 256 * 1024 * 1024,
+                 sync_every: int = 1024):
+        self.base_path = base_path
+        self.pack_size = pack_size
+        self.sync_every = sync_every
+        self.index = {}        # content_hash -> (pack id, data offset, length)
+        self.pack_sizes = {}   # pack id -> bytes written
+        self.dead_bytes = {}   # pack id -> bytes no longer referenced
+        self.read_fds = {}
+        self.lock = threading.Lock()        # appends, deletes and index log
+        self.layout = ReadWriteLock()       # readers share; compaction moves blobs
+        self._unsynced = 0
+        os.makedirs(base_path, exist_ok=True)
+
+        for name in sorted(os.listdir(base_path)):
+            if name.startswith('pack-') and name.endswith('.dat'):
+                pack_id = int(name[5:-4])
+                self.pack_sizes[pack_id] = os.path.getsize(os.path.join(base_path, name))
+                self.dead_bytes[pack_id] = 0
+
+        index_path = self._index_path()
+        indexed = self._load_index(index_path) if os.path.exists(index_path) else {}
+        for pack_id in sorted(self.pack_sizes):
+            self._scan_pack(pack_id, indexed.get(pack_id, 0))
+        self.index_fd = self._open_index()
+
+        self.active_id = max(self.pack_sizes, default=0)
+        self._open_active(self.active_id or 1)
+
+    def _pack_path(self, pack_id: int) -> str:
+        return os.path.join(self.base_path, f"pack-{pack_id:06d}.dat")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.base_path, "index.log")
+
+    def _open_index(self) -> int:
+        return os.open(self._index_path(), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def metadata_path(self) -> str:
+        return os.path.join(self.base_path, "meta")
+
+    # Recovery
+
+    def _load_index(self, index_path: str) -> Dict[int, int]:
+        """Replay the index log; returns each pack's end offset of indexed blobs"""
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        usable = len(data) - len(data) % self.INDEX_ENTRY.size
+        if usable < len(data):
+            os.truncate(index_path, usable)  # drop a torn tail so new entries stay aligned
+        indexed = {}
+        for op, digest, pack_id, offset, length in self.INDEX_ENTRY.iter_unpack(data[:usable]):
+            if offset + length > self.pack_sizes.get(pack_id, -1):
+                continue
+            indexed[pack_id] = max(indexed.get(pack_id, 0), offset + length)
+            if op == self.ADD:
+                self._index_add(digest.hex(), pack_id, offset, length)
+            elif op == self.DELETE:
+                self._index_remove(digest.hex())
+        return indexed
+
+    def _scan_pack(self, pack_id: int, start: int = 0):
+        """Index the blobs after start, truncating a torn or corrupt last record"""
+        path = self._pack_path(pack_id)
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        offset = 0
+        while offset + self.RECORD.size <= len(data):
+            digest, length = self.RECORD.unpack_from(data, offset)
+            begin = offset + self.RECORD.size
+            if begin + length > len(data) or hashlib.sha256(data[begin:begin + length]).digest() != digest:
+                break
+            self._index_add(digest.hex(), pack_id, start + begin, length)
+            offset = begin + length
+        if offset < len(data):
+            os.truncate(path, start + offset)
+            self.pack_sizes[pack_id] = start + offset
+
+    def _index_add(self, content_hash: str, pack_id: int, offset: int, length: int):
+        self._index_remove(content_hash)
+        self.index[content_hash] = (pack_id, offset, length)
+
+    def _index_remove(self, content_hash: str) -> Optional[tuple]:
+        entry = self.index.pop(content_hash, None)
+        if entry is not None:
+            self.dead_bytes[entry[0]] = self.dead_bytes.get(entry[0], 0) + self.RECORD.size + entry[2]
+        return entry
+
+    # Writes
+
+    def _open_active(self, pack_id: int):
+        self.active_id = pack_id
+        self.active_fd = os.open(self._pack_path(pack_id), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.pack_sizes.setdefault(pack_id, 0)
+        self.dead_bytes.setdefault(pack_id, 0)
+
+    def _append(self, content_hash: str, data: bytes):
+        """Append one record to the active pack (lock held)"""
+        if self.pack_sizes[self.active_id] and self.pack_sizes[self.active_id] + len(data) > self.pack_size:
+            self._sync()
+            os.close(self.active_fd)
+            self._open_active(self.active_id + 1)
+
+        digest = bytes.fromhex(content_hash)
+        offset = self.pack_sizes[self.active_id] + self.RECORD.size
+        os.writev(self.active_fd, [self.RECORD.pack(digest, len(data)), data])
+        self.pack_sizes[self.active_id] = offset + len(data)
+        self._index_add(content_hash, self.active_id, offset, len(data))
+        self._log(self.ADD, digest, self.active_id, offset, len(data))
+
+    def _log(self, op: int, digest: bytes, pack_id: int, offset: int, length: int):
+        os.write(self.index_fd, self.INDEX_ENTRY.pack(op, digest, pack_id, offset, length))
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self._sync()
+
+    def _sync(self):
+        """Group commit: pack data first, then the index records naming it"""
+        if not self._unsynced:
+            return
+        os.fsync(self.active_fd)
+        os.fsync(self.index_fd)
+        self._unsynced = 0
+
+    def write(self, data: bytes, content_hash: Optional[str] = None) -> str:
+        content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if content_hash not in self.index:
+                self._append(content_hash, data)
+        return content_hash
+
+    def delete(self, content_hash: str) -> int:
+        with self.lock:
+            entry = self._index_remove(content_hash)
+            if entry is None:
+                return 0
+            self._log(self.DELETE, bytes.fromhex(content_hash), *entry)
+            return entry[2]
+
+    def flush(self):
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            os.close(self.index_fd)
+            os.close(self.active_fd)
+            for fd in self.read_fds.values():
+                os.close(fd)
+            self.read_fds.clear()
+
+    # Reads
+
+    def _reader(self, pack_id: int) -> int:
+        fd = self.read_fds.get(pack_id)
+        if fd is None:
+            with self.lock:
+                fd = self.read_fds.get(pack_id)
+                if fd is None:
+                    fd = self.read_fds[pack_id] = os.open(self._pack_path(pack_id), os.O_RDONLY)
+        return fd
+
+    def read(self, content_hash: str) -> bytes:
+        with self.layout.read:
+            pack_id, offset, length = self.index[content_hash]
+            return os.pread(self._reader(pack_id), length, offset)
+
+    def read_range(self, content_hash: str, offset: int, length: int) -> memoryview:
+        with self.layout.read:
+            pack_id, start, size = self.index[content_hash]
+            length = max(0, min(length, size - offset))
+            return memoryview(os.pread(self._reader(pack_id), length, start + offset))
+
+    def list_hashes(self):
+        return list(self.index)
+
+    # Compaction
+
+    def compact(self, min_dead_ratio: float = 0.5) -> int:
+        """Rewrite sealed packs that are mostly dead; returns bytes reclaimed.
+
+        Live blobs are appended to the active pack, then the old pack file
+        is removed and the index log is rewritten to list only live blobs.
+        Readers are excluded only while one pack is being moved.
+        """
+        reclaimed = 0
+        for pack_id in sorted(self.pack_sizes):
+            size = self.pack_sizes[pack_id]
+            if pack_id == self.active_id or not size or self.dead_bytes[pack_id] / size < min_dead_ratio:
+                continue
+
+            with self.layout.write, self.lock:
+                fd = os.open(self._pack_path(pack_id), os.O_RDONLY)
+                live = [(h, e) for h, e in self.index.items() if e[0] == pack_id]
+                for content_hash, (_, offset, length) in live:
+                    self._append(content_hash, os.pread(fd, length, offset))
+                self._sync()
+
+                os.close(fd)
+                if pack_id in self.read_fds:
+                    os.close(self.read_fds.pop(pack_id))
+                os.remove(self._pack_path(pack_id))
+                reclaimed += size - sum(self.RECORD.size + e[2] for _, e in live)
+                del self.pack_sizes[pack_id]
+                del self.dead_bytes[pack_id]
+
+        if reclaimed:
+            self._rewrite_index()
+        return reclaimed
+
+    def _rewrite_index(self):
+        with self.lock:
+            self._sync()
+            tmp_path = self._index_path() + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                for content_hash, (pack_id, offset, length) in self.index.items():
+                    f.write(self.INDEX_ENTRY.pack(self.ADD, bytes.fromhex(content_hash), pack_id, offset, length))
+                for pack_id, size in self.pack_sizes.items():  # dead blobs past the last live one stay dead
+                    f.write(self.INDEX_ENTRY.pack(self.INDEXED, bytes(32), pack_id, size, 0))
+                f.flush()
+                os.fsync(f.fileno())
+            os.close(self.index_fd)
+            os.replace(tmp_path, self._index_path())
+            self.index_fd = self._open_index()
+
+# ======================
+# Distributed Components
+# ======================
+
+class ConsistentHasher:
+    def __init__(self, nodes=None, virtual_nodes: int = 256):
+        self.nodes = []
+        self.virtual_nodes = virtual_nodes
+        self.ring = {}            # ring hash -> node
+        self.sorted_hashes = []   # ring hashes kept in ascending order
+
+        for node in nodes or []:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.sha1(key.encode()).digest(), 'big')
+
+    def _virtual_hashes(self, node) -> List[int]:
+        return [self._hash(f"{node}-{i}") for i in range(self.virtual_nodes)]
+
+    def add_node(self, node):
+        """Insert a node's virtual points without rebuilding the ring"""
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for hash_key in self._virtual_hashes(node):
+            if hash_key not in self.ring:
+                insort(self.sorted_hashes, hash_key)
+            self.ring[hash_key] = node
+
+    def remove_node(self, node):
+        """Drop a node's virtual points without rebuilding the ring"""
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        for hash_key in self._virtual_hashes(node):
+            if self.ring.get(hash_key) != node:
+                continue
+            del self.ring[hash_key]
+            idx = bisect_left(self.sorted_hashes, hash_key)
+            del self.sorted_hashes[idx]
+
+    def get_node(self, key: str):
+        if not self.sorted_hashes:
+            return None
+        return self._owner_of(self._hash(key))
+
+    def _owner_of(self, key_hash: int):
+        idx = bisect_left(self.sorted_hashes, key_hash)
+        if idx == len(self.sorted_hashes):
+            idx = 0
+        return self.ring[self.sorted_hashes[idx]]
+
+    def copy(self) -> 'ConsistentHasher':
+        clone = ConsistentHasher(virtual_nodes=self.virtual_nodes)
+        clone.nodes = list(self.nodes)
+        clone.ring = dict(self.ring)
+        clone.sorted_hashes = list(self.sorted_hashes)
+        return clone
+
+    def moved_ranges(self, previous: 'ConsistentHasher') -> List[Tuple[int, int, object, object]]:
+        """Arcs (start, end] whose owner differs from previous, as (start, end, old, new).
+
+        Arcs are cut at every point of either ring, so each has one owner
+        per ring. The first arc wraps around zero (start > end).
+        """
+        points = sorted(set(self.sorted_hashes) | set(previous.sorted_hashes))
+        if not self.sorted_hashes or not previous.sorted_hashes:
+            return []
+        moved = []
+        for i, end in enumerate(points):
+            old, new = previous._owner_of(end), self._owner_of(end)
+            if old != new:
+                moved.append((points[i - 1], end, old, new))
+        return moved
+
+    def get_nodes_bulk(self, keys) -> List:
+        """Route many keys in one call; result is aligned with ``keys``"""
+        hashes = self.sorted_hashes
+        if not hashes:
+            return [None] * len(keys)
+
+        ring, sha1, n = self.ring, hashlib.sha1, len(hashes)
+        result = []
+        for key in keys:
+            idx = bisect_left(hashes, int.from_bytes(sha1(key.encode()).digest(), 'big'))
+            result.append(ring[hashes[idx if idx < n else 0]])
+        return result
+
+# ======================
+# Concurrency Primitives
+# ======================
+
+class _LockGuard:
+    __slots__ = ('_acquire', '_release')
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._release()
+
+class ReadWriteLock:
+    """Writer-preferring reader-writer lock.
+
+    Both sides are reentrant, and the writing thread may also take the
+    read side, so locked helpers can nest. Upgrading a held read lock to
+    a write lock is refused rather than left to deadlock.
+
+        with lock.read: ...
+        with lock.write: ...
+    """
+
+    def __init__(self, on_wait=None):
+        self._cond = threading.Condition(threading.Lock())
+        self.on_wait = on_wait  # called with seconds spent blocked, if any
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+        self.read = _LockGuard(self.acquire_read, self.release_read)
+        self.write = _LockGuard(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        local = self._local
+        depth = getattr(local, 'read_depth', 0)
+        if depth:
+            local.read_depth = depth + 1
+            return
+        if self._writer == threading.get_ident():
+            local.read_depth, local.read_counted = 1, False
+            return
+
+        with self._cond:
+            if self._writer is not None or self._writers_waiting:
+                started = time.perf_counter()
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._waited(time.perf_counter() - started)
+            self._readers += 1
+        local.read_depth, local.read_counted = 1, True
+
+    def release_read(self):
+        local = self._local
+        local.read_depth -= 1
+        if local.read_depth or not local.read_counted:
+            return
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if getattr(self._local, 'read_depth', 0):
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+
+            self._writers_waiting += 1
+            if self._writer is not None or self._readers:
+                started = time.perf_counter()
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waited(time.perf_counter() - started)
+            self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def _waited(self, seconds: float):
+        if self.on_wait is not None:
+            self.on_wait(seconds)
+
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+# ======================
+# Instrumentation
+# ======================
+
+class _MetricsShard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+class _ShardOwner:
+    """Held only by a thread's locals; its finalizer retires the thread's shard"""
+    __slots__ = ('__weakref__',)
+
+class Metrics:
+    """Counters and latency histograms recorded into per-thread shards.
+
+    Each thread only touches its own shard, so recording takes no lock;
+    snapshot() merges the shards. Latencies land in log-scale buckets
+    (four per power of two nanoseconds), so percentiles are accurate to
+    within about 19%. When a thread exits its shard is folded into a
+    retired total, so thread churn does not grow the shard list.
+    """
+
+    BUCKETS = 256
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = set()
+        self._retired = _MetricsShard()
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> _MetricsShard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _MetricsShard()
+            # The owner lives only in this thread's locals, so it dies with the thread
+            owner = self._local.owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, shard)
+            with self._shards_lock:
+                self._shards.add(shard)
+            return shard
+
+    def _retire(self, shard: _MetricsShard):
+        with self._shards_lock:
+            self._shards.discard(shard)
+            self._merge(self._retired, shard)
+
+    @classmethod
+    def _merge(cls, into: _MetricsShard, shard: _MetricsShard):
+        for name, value in dict(shard.counters).items():
+            into.counters[name] = into.counters.get(name, 0) + value
+        for op, histogram in dict(shard.histograms).items():
+            merged = into.histograms.setdefault(op, [0] * cls.BUCKETS)
+            for i, count in enumerate(list(histogram)):
+                merged[i] += count
+
+    def incr(self, name: str, amount=1):
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def observe(self, op: str, seconds: float):
+        shard = self._shard()
+        histogram = shard.histograms.get(op)
+        if histogram is None:
+            histogram = shard.histograms[op] = [0] * self.BUCKETS
+        ns = seconds * 1e9
+        histogram[min(int(math.log2(ns) * 4), self.BUCKETS - 1) if ns >= 1 else 0] += 1
+
+    def snapshot(self) -> Dict:
+        total = _MetricsShard()
+        with self._shards_lock:
+            shards = list(self._shards)
+            self._merge(total, self._retired)
+        for shard in shards:
+            self._merge(total, shard)
+        counters, histograms = total.counters, total.histograms
+
+        latency = {}
+        for op, histogram in histograms.items():
+            total = sum(histogram)
+            latency[op] = {
+                'count': total,
+                'p50': self._percentile(histogram, total, 0.50),
+                'p99': self._percentile(histogram, total, 0.99),
+            }
+        return {'counters': counters, 'latency': latency}
+
+    @staticmethod
+    def _percentile(histogram: List[int], total: int, q: float) -> float:
+        """Upper bound, in seconds, of the bucket holding the q-th sample"""
+        rank, seen = q * total, 0
+        for i, count in enumerate(histogram):
+            seen += count
+            if count and seen >= rank:
+                return 2 ** ((i + 1) / 4) / 1e9
+        return 0.0
+
+def _instrumented(op: str):
+    """Count an operation and record its latency in fs.metrics"""
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(op, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+# ======================
+# Path Cache
+# ======================
+
+class _CacheTrieNode:
+    __slots__ = ('parent', 'name', 'children', 'path')
+
+    def __init__(self, parent=None, name=None):
+        self.parent = parent
+        self.name = name
+        self.children = {}
+        self.path = None  # set while this component has a cache entry
+
+class PathCache:
+    """Bounded LRU path cache indexed by a component trie.
+
+    Invalidating a path only walks its own components and the cached
+    entries below it, so siblings sharing a string prefix are untouched.
+    """
+
+    def __init__(self, max_size: int = 100_000):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # path -> (node, trie node)
+        self.trie = _CacheTrieNode()
+        self.lock = threading.Lock()  # readers share the cache concurrently
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path: str):
+        return path in self.entries
+
+    def get(self, path: str) -> Optional[Node]:
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+            self.entries.move_to_end(path)
+            return entry[0]
+
+    def put(self, path: str, node: Node):
+        with self.lock:
+            self._put(path, node)
+
+    def _put(self, path: str, node: Node):
+        entry = self.entries.get(path)
+        if entry is not None:
+            self.entries[path] = (node, entry[1])
+            self.entries.move_to_end(path)
+            return
+
+        trie_node = self.trie
+        for part in path.split('/')[1:]:
+            child = trie_node.children.get(part)
+            if child is None:
+                child = trie_node.children[part] = _CacheTrieNode(trie_node, part)
+            trie_node = child
+        trie_node.path = path
+        self.entries[path] = (node, trie_node)
+
+        while len(self.entries) > self.max_size:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            evicted.path = None
+            self._prune(evicted)
+
+    def invalidate(self, path: str):
+        """Drop the entry for path and every cached entry beneath it"""
+        with self.lock:
+            self._invalidate(path)
+
+    def _invalidate(self, path: str):
+        trie_node = self.trie
+        for part in path.split('/')[1:]:
+            trie_node = trie_node.children.get(part)
+            if trie_node is None:
+                return
+
+        stack = [trie_node]
+        while stack:
+            current = stack.pop()
+            if current.path is not None:
+                del self.entries[current.path]
+                current.path = None
+            stack.extend(current.children.values())
+
+        trie_node.children = {}
+        self._prune(trie_node)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.trie = _CacheTrieNode()
+
+    def _prune(self, trie_node: _CacheTrieNode):
+        """Remove trie nodes that no longer lead to any cached entry"""
+        while (trie_node.parent is not None and trie_node.path is None
+               and not trie_node.children):
+            del trie_node.parent.children[trie_node.name]
+            trie_node = trie_node.parent
+
+# ======================
+# Streaming File Handles
+# ======================
+
+class ChunkedWriter:
+    """Write-only stream that stores content as fixed-size chunks.
+
+    Each chunk is compressed and written to the storage backend as soon as
+    it fills, so at most one chunk is buffered. The file becomes visible
+    at its path when the writer is closed.
+    """
+
+    def __init__(self, fs: 'DistributedFileSystem', path: str, compress: bool = True,
+                 codec: Optional[str] = None):
+        self._fs = fs
+        self.path = path
+        self.compress = compress
+        self.codec = codec or fs.codec
+        self.chunk_size = fs.chunk_size
+        self.chunks = []
+        self.size = 0
+        self.closed = False
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """Abandon the partial file; its chunks become garbage"""
+        if not self.closed:
+            self.closed = True
+            self._fs._unpin_blobs([c[0] for c in self.chunks])
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._store_chunk(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        if not self.chunks and len(self._buffer) <= self._fs.inline_threshold:
+            self.closed = True
+            self._fs._link_file(self.path, self._fs._inline_meta(bytes(self._buffer)))
+            return
+        if self._buffer or not self.chunks:
+            self._store_chunk(bytes(self._buffer))
+            self._buffer = bytearray()
+        self.closed = True
+
+        manifest = hashlib.sha256(''.join(c[0] for c in self.chunks).encode()).digest()
+        now = time.time()
+        try:
+            self._fs._link_file(self.path, FileMetadata(
+                digest=manifest,
+                size=self.size,
+                compressed=any(c[2] for c in self.chunks),
+                created_at=now,
+                modified_at=now,
+                chunks=self.chunks,
+                codec=self.codec
+            ))
+        finally:
+            self._fs._unpin_blobs([c[0] for c in self.chunks])
+
+    def _store_chunk(self, chunk: bytes):
+        payload, compressed = self._fs._encode(chunk, self.compress, self.codec)
+        self.chunks.append((self._fs._store_payload(payload), len(chunk), compressed))
+        self.size += len(chunk)
+
+class ChunkedReader:
+    """Seekable read-only stream over a file's chunks.
+
+    Only the chunks overlapping a requested range are fetched and
+    decompressed, and only the most recent chunk is kept in memory. The
+    chunks stay pinned against garbage collection until close().
+    """
+
+    def __init__(self, fs: 'DistributedFileSystem', meta: FileMetadata):
+        self._fs = fs
+        self.size = meta.size
+        self.inline = meta.inline
+        if self.inline is not None:
+            self.chunks = []
+        else:
+            self.chunks = meta.chunks or [(meta.content_hash, meta.size, meta.compressed)]
+        self.codec = meta.codec
+        self.offsets = []
+        offset = 0
+        for _, length, _ in self.chunks:
+            self.offsets.append(offset)
+            offset += length
+        self.closed = False
+        self._pos = 0
+        self._current = (None, b'')  # (chunk index, decoded bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if size is None or size < 0:
+            size = self.size - self._pos
+        data = self.read_range(self._pos, size)
+        self._pos += len(data)
+        return data
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """Return up to length bytes starting at offset"""
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return b''
+        if self.inline is not None:
+            return self.inline[offset:end]
+
+        parts = []
+        index = bisect_right(self.offsets, offset) - 1
+        while offset < end:
+            start = offset - self.offsets[index]
+            stop = min(self.chunks[index][1], end - self.offsets[index])
+            parts.append(self._slice(index, start, stop))
+            offset += stop - start
+            index += 1
+        return b''.join(parts)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._current = (None, b'')
+            self._fs._unpin_blobs([c[0] for c in self.chunks])
+
+    def _slice(self, index: int, start: int, stop: int) -> bytes:
+        content_hash, _, compressed = self.chunks[index]
+        if not compressed:
+            # Uncompressed chunks support ranged (mmap-backed) backend reads
+            return bytes(self._fs.storage.read_range(content_hash, start, stop - start))
+        return self._chunk(index)[start:stop]
+
+    def _chunk(self, index: int) -> bytes:
+        if self._current[0] != index:
+            content_hash, _, compressed = self.chunks[index]
+            payload = self._fs.storage.read(content_hash)
+            self._current = (index, self._fs._decode(payload, compressed, self.codec))
+        return self._current[1]
+
+# ======================
+# Background Jobs
+# ======================
+
+class RecompressionJob:
+    """Online, resumable pass that compresses files stored raw.
+
+    The tree is walked one directory page at a time under the read lock,
+    candidates are recompressed on the filesystem's executor, and each
+    page's results are swapped into the metadata in one short write
+    section, only for files that did not change meanwhile. The walk
+    cursor survives pause(), so start() resumes where it stopped. An
+    optional bytes_per_second cap throttles the pass to protect
+    foreground latency.
+    """
+
+    def __init__(self, fs: 'DistributedFileSystem', min_size: int = 1024, codec: Optional[str] = None,
+                 bytes_per_second: Optional[float] = None, page_size: int = 256):
+        self.fs = fs
+        self.min_size = min_size
+        self.codec = codec or fs.codec
+        self.bytes_per_second = bytes_per_second
+        self.page_size = page_size
+        self.pending = [('/', None)]  # (directory, last name scanned) stack
+        self.files_scanned = 0
+        self.files_compressed = 0
+        self.bytes_read = 0
+        self.bytes_saved = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def done(self) -> bool:
+        return not self.pending
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> 'RecompressionJob':
+        if not self.running and not self.done:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="recompression", daemon=True)
+            self._thread.start()
+        return self
+
+    def pause(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.done
+
+    def _run(self):
+        # Throttle only this run's reads; bytes read before a pause were paid for then
+        started, baseline = time.monotonic(), self.bytes_read
+        while not self.done and not self._stop.is_set():
+            self.step()
+            if self.bytes_per_second:
+                ahead = (self.bytes_read - baseline) / self.bytes_per_second - (time.monotonic() - started)
+                if ahead > 0:
+                    self._stop.wait(ahead)
+
+    def step(self):
+        """Scan one directory page and recompress its candidates"""
+        dir_path, start_after = self.pending[-1]
+        entries = self.fs._list_entries(dir_path, start_after, self.page_size)
+        if not entries:
+            self.pending.pop()
+            self._publish()
+            return
+        self.pending[-1] = (dir_path, entries[-1][0])
+
+        candidates = []
+        for name, node in entries:
+            path = f"{dir_path.rstrip('/')}/{name}"
+            if isinstance(node, DirectoryMetadata):
+                self.pending.append((path, None))
+                continue
+            self.files_scanned += 1
+            if (not node.compressed and not node.chunks and node.inline is None
+                    and node.size >= self.min_size):
+                candidates.append((path, node))
+
+        results = [r for r in self.fs.executor.map(self._recompress, candidates) if r]
+        self.bytes_read += sum(meta.size for _, meta in candidates)
+        swapped = self.fs._swap_files([(path, old, new) for path, old, new, _ in results])
+        for (path, old, new, payload_size), ok in zip(results, swapped):
+            if ok:
+                self.files_compressed += 1
+                self.bytes_saved += old.size - payload_size
+        self.fs._unpin_blobs(new.content_hash for _, _, new, _ in results)
+        self._publish()
+
+    def _publish(self):
+        self.fs.stats.update(
+            recompression_scanned=self.files_scanned,
+            recompression_files=self.files_compressed,
+            recompression_bytes_saved=self.bytes_saved,
+            recompression_done=self.done
+        )
+
+    def _recompress(self, candidate):
+        path, meta = candidate
+        self.fs._pin_blobs([meta.content_hash])
+        try:
+            content = self.fs.storage.read(meta.content_hash)
+        except (KeyError, FileNotFoundError):
+            return None  # overwritten and reclaimed since the page was listed
+        finally:
+            self.fs._unpin_blobs([meta.content_hash])
+
+        payload, compressed = self.fs._encode(content, True, self.codec)
+        if not compressed:
+            return None
+        digest = bytes.fromhex(self.fs._store_payload(payload))
+        new = replace(meta, digest=digest, compressed=True, codec=self.codec)
+        return path, meta, new, len(payload)
+
+# ======================
+# Metadata Journal
+# ======================
+
+class MetadataJournal:
+    """Write-ahead log of tree mutations plus compact binary snapshots.
+
+    Every mkdir, file link and unlink appends one checksummed record to the
+    current journal generation. Records reach the OS on append; a flusher
+    thread fsyncs them as a group every sync_interval seconds, or as soon as
+    sync_every are pending, without holding the append lock, and flush()
+    waits for such a group commit.
+    A checkpoint rotates to a new generation and snapshots the whole
+    tree, after which the generations it covers are deleted.
+
+    Recovery maps the latest snapshot and replays only the generations
+    after it, so restart cost is bounded by snapshot_every records
+    rather than by the number of operations since boot.
+
+    The journal holds an exclusive lock on its directory, so a second live
+    instance cannot interleave records or free blobs the first still uses.
+    before_sync runs ahead of every group commit to make the blobs the
+    pending records name durable first; after_sync then receives the blob
+    hashes those records freed, which are only safe to delete once the
+    records are durable.
+    """
+
+    RECORD = struct.Struct('<BII')      # op, payload length, crc32
+    SNAPSHOT = struct.Struct('<4sIQI')  # magic, first uncovered generation, entries, crc32
+    META = struct.Struct('<QddBB')      # size, created_at, modified_at, flags, digest length
+    CHUNK = struct.Struct('<32sQ?')     # digest, raw size, compressed
+    COUNT = struct.Struct('<I')
+    NAME = struct.Struct('<H')
+    MAGIC = b'DFS1'
+    MKDIR, LINK, UNLINK = 1, 2, 3
+    DIR, FILE = 0, 1
+    COMPRESSED, INLINE, CHUNKED = 1, 2, 4
+
+    def __init__(self, base_path: str, sync_every: int = 1024, snapshot_every: int = 100_000,
+                 before_sync=None, after_sync=None, sync_interval: float = 0.05):
+        self.base_path = base_path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+        self.before_sync = before_sync
+        self.after_sync = after_sync
+        self.generation = 0
+        self.records = 0  # appended since the last checkpoint
+        self.checkpoint_pending = False
+        self.fd = None
+        self.retired = []  # rotated-out generations awaiting their last fsync
+        self.freed = []    # blob hashes freed by records not yet fsynced
+        self.lock = threading.Lock()       # appends and generation switches
+        self.sync_lock = threading.Lock()  # one group commit at a time
+        # written only moves under lock, synced only under sync_lock
+        self.written = 0
+        self.synced = 0
+        self.due = threading.Event()
+        self.closing = threading.Event()
+        self.flusher = None
+        os.makedirs(base_path, exist_ok=True)
+        self.lock_fd = self._acquire_directory()
+
+    def _acquire_directory(self) -> Optional[int]:
+        if fcntl is None:
+            return None
+        fd = os.open(os.path.join(self.base_path, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise RuntimeError(f"Metadata journal {self.base_path} is in use by another instance") from None
+        return fd
+
+    def _journal_path(self, generation: int) -> str:
+        return os.path.join(self.base_path, f"journal-{generation:06d}.log")
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.base_path, "snapshot.bin")
+
+    def _generations(self) -> List[int]:
+        return sorted(int(name[8:-4]) for name in os.listdir(self.base_path)
+                      if name.startswith('journal-') and name.endswith('.log'))
+
+    def _open(self, generation: int):
+        self.generation = generation
+        self.fd = os.open(self._journal_path(generation), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    # Recovery
+
+    def recover(self, entry_name=sys.intern) -> Tuple[Optional['DirectoryMetadata'], List[tuple]]:
+        """Return (snapshot root or None, journal tail records) and reopen for appends"""
+        root, covered = self._load_snapshot(entry_name)
+        generations = []
+        for generation in self._generations():
+            if generation < covered:
+                os.remove(self._journal_path(generation))  # left over from an interrupted checkpoint
+            else:
+                generations.append(generation)
+
+        records = []
+        for generation in generations:
+            records.extend(self._read_journal(generation))
+        self.records = len(records)
+        self._open(max(generations, default=max(covered, 1)))
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+        return root, records
+
+    def _load_snapshot(self, entry_name):
+        try:
+            f = open(self._snapshot_path(), 'rb')
+        except FileNotFoundError:
+            return None, 0
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, covered, _, crc = self.SNAPSHOT.unpack_from(view)
+            with memoryview(view) as whole, whole[self.SNAPSHOT.size:] as body:
+                intact = magic == self.MAGIC and zlib.crc32(body) == crc
+            if not intact:
+                raise ValueError("Corrupt metadata snapshot")
+            return self._decode_tree(view, self.SNAPSHOT.size, entry_name), covered
+
+    def _read_journal(self, generation: int) -> List[tuple]:
+        path = self._journal_path(generation)
+        with open(path, 'rb') as f:
+            data = f.read()
+        records = []
+        offset = 0
+        while offset + self.RECORD.size <= len(data):
+            op, length, crc = self.RECORD.unpack_from(data, offset)
+            start = offset + self.RECORD.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            path_name, end = self._unpack_name(payload, 0)
+            records.append((op, path_name, self._unpack_meta(payload, end)[0] if op == self.LINK else None))
+            offset = start + length
+        if offset < len(data):
+            os.truncate(path, offset)  # drop a torn tail so new records follow valid ones
+        return records
+
+    # Appends
+
+    def log_mkdir(self, path: str) -> bool:
+        return self._append(self.MKDIR, self._pack_name(path))
+
+    def log_link(self, path: str, meta: 'FileMetadata', freed=()) -> bool:
+        return self._append(self.LINK, self._pack_name(path) + self._pack_meta(meta), freed)
+
+    def log_unlink(self, path: str, freed=()) -> bool:
+        return self._append(self.UNLINK, self._pack_name(path), freed)
+
+    def _append(self, op: int, payload: bytes, freed=()) -> bool:
+        """Write one record and queue the blobs it frees; returns True when a checkpoint is due.
+
+        Only the first call past snapshot_every returns True; the next
+        rotate() (or a failed checkpoint) re-arms it, however long the
+        recovered tail was.
+        """
+        record = self.RECORD.pack(op, len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            os.write(self.fd, record)
+            self.written += 1
+            self.freed.extend(freed)
+            if self.written - self.synced >= self.sync_every:
+                self.due.set()
+            self.records += 1
+            if self.records < self.snapshot_every or self.checkpoint_pending:
+                return False
+            self.checkpoint_pending = True
+            return True
+
+    def flush(self):
+        """Group commit: make every record appended so far durable, then hand what they freed to after_sync.
+
+        Appends only wait for the short section that takes the pending
+        work; the fsyncs run outside the append lock.
+        """
+        with self.sync_lock:
+            with self.lock:
+                written, freed, retired = self.written, self.freed, self.retired
+                self.freed, self.retired = [], []
+                fds = retired + ([self.fd] if self.fd is not None else [])
+            if written != self.synced:
+                if self.before_sync is not None:
+                    self.before_sync()
+                for fd in fds:
+                    os.fsync(fd)
+                self.synced = written
+            for fd in retired:
+                os.close(fd)
+            if freed and self.after_sync is not None:
+                self.after_sync(freed)
+
+    def _flush_loop(self):
+        while not self.closing.is_set():
+            self.due.wait(self.sync_interval)
+            self.due.clear()
+            self.flush()
+
+    def close(self):
+        self.closing.set()
+        self.due.set()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
+        with self.sync_lock, self.lock:
+            os.close(self.fd)
+            self.fd = None
+            if self.lock_fd is not None:
+                os.close(self.lock_fd)  # releases the directory lock
+                self.lock_fd = None
+
+    # Checkpoints
+
+    def rotate(self) -> int:
+        """Start a new generation; the tree must not change until it is encoded.
+
+        The old generation is fsynced by the next group commit, not here.
+        """
+        with self.lock:
+            self.retired.append(self.fd)
+            self._open(self.generation + 1)
+            self.records = 0
+            self.checkpoint_pending = False
+            return self.generation
+
+    def encode_tree(self, root: 'DirectoryMetadata') -> Tuple[List[bytes], int]:
+        """Pre-order encoding; each directory is followed by its child count"""
+        parts = [self.COUNT.pack(len(root.children))]
+        entries = 0
+        stack = [iter(root.children.items())]
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop()
+                continue
+            name, node = entry
+            entries += 1
+            if isinstance(node, DirectoryMetadata):
+                parts.append(bytes([self.DIR]) + self._pack_name(name) + self.COUNT.pack(len(node.children)))
+                stack.append(iter(node.children.items()))
+            else:
+                parts.append(bytes([self.FILE]) + self._pack_name(name) + self._pack_meta(node))
+        return parts, entries
+
+    def write_snapshot(self, generation: int, parts: List[bytes], entries: int) -> int:
+        """Atomically replace the snapshot, then drop the journals it covers"""
+        self.flush()  # commits and closes the generations being dropped
+        body = b''.join(parts)
+        header = self.SNAPSHOT.pack(self.MAGIC, generation, entries, zlib.crc32(body))
+        tmp_path = self._snapshot_path() + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._snapshot_path())
+
+        for old in self._generations():
+            if old < generation:
+                os.remove(self._journal_path(old))
+        return len(header) + len(body)
+
+    # Encoding (shared with rebalancing, which ships metadata between nodes)
+
+    @classmethod
+    def _pack_name(cls, name: str) -> bytes:
+        encoded = name.encode()
+        return cls.NAME.pack(len(encoded)) + encoded
+
+    @classmethod
+    def _unpack_name(cls, buf, offset: int) -> Tuple[str, int]:
+        (length,) = cls.NAME.unpack_from(buf, offset)
+        offset += cls.NAME.size
+        return str(buf[offset:offset + length], 'utf-8'), offset + length
+
+    @classmethod
+    def _pack_meta(cls, meta: 'FileMetadata') -> bytes:
+        flags = ((cls.COMPRESSED if meta.compressed else 0) |
+                 (cls.INLINE if meta.inline is not None else 0) |
+                 (cls.CHUNKED if meta.chunks else 0))
+        parts = [cls.META.pack(meta.size, meta.created_at, meta.modified_at, flags, len(meta.digest)),
+                 meta.digest, cls._pack_name(meta.codec)]
+        if meta.inline is not None:
+            parts += [cls.COUNT.pack(len(meta.inline)), meta.inline]
+        if meta.chunks:
+            parts.append(cls.COUNT.pack(len(meta.chunks)))
+            parts += [cls.CHUNK.pack(bytes.fromhex(h), size, compressed) for h, size, compressed in meta.chunks]
+        return b''.join(parts)
+
+    @classmethod
+    def _unpack_meta(cls, buf, offset: int) -> Tuple['FileMetadata', int]:
+        size, created_at, modified_at, flags, digest_length = cls.META.unpack_from(buf, offset)
+        offset += cls.META.size
+        digest = buf[offset:offset + digest_length]
+        codec, offset = cls._unpack_name(buf, offset + digest_length)
+        inline = chunks = None
+        if flags & cls.INLINE:
+            (length,) = cls.COUNT.unpack_from(buf, offset)
+            offset += cls.COUNT.size
+            inline = buf[offset:offset + length]
+            offset += length
+        if flags & cls.CHUNKED:
+            (count,) = cls.COUNT.unpack_from(buf, offset)
+            offset += cls.COUNT.size
+            end = offset + count * cls.CHUNK.size
+            chunks = [(d.hex(), s, c) for d, s, c in cls.CHUNK.iter_unpack(buf[offset:end])]
+            offset = end
+        return FileMetadata(digest, size, bool(flags & cls.COMPRESSED), created_at, modified_at,
+                            chunks, sys.intern(codec), inline), offset
+
+    def _decode_tree(self, buf, offset: int, entry_name) -> 'DirectoryMetadata':
+        """Rebuild the tree; children arrive sorted, so each directory is built in one pass"""
+        root = DirectoryMetadata()
+        (count,) = self.COUNT.unpack_from(buf, offset)
+        offset += self.COUNT.size
+        stack = [[root, count, {}]]  # directory, children left to read, children read
+        while stack:
+            top = stack[-1]
+            if not top[1]:
+                stack.pop()
+                top[0].children = SortedChildren(top[2])
+                continue
+            top[1] -= 1
+            kind = buf[offset]
+            name, offset = self._unpack_name(buf, offset + 1)
+            if kind == self.DIR:
+                (count,) = self.COUNT.unpack_from(buf, offset)
+                offset += self.COUNT.size
+                node = DirectoryMetadata()
+                stack.append([node, count, {}])
+            else:
+                node, offset = self._unpack_meta(buf, offset)
+            top[2][entry_name(name)] = node
+        return root
+
+# ======================
+# Cluster RPC
+# ======================
+
+RPC_FRAME = struct.Struct('<QI')  # request id, payload length
+RPC_NONCE = 32
+
+def _proof(secret: bytes, nonce: bytes) -> bytes:
+    return hmac.digest(secret, nonce, 'sha256')
+
+def _is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def _recv_exact(sock: socket.socket, size: int) -> bytearray:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise EOFError("Connection closed")
+        view = view[received:]
+    return buf
+
+def _send_frame(sock: socket.socket, request_id: int, payload: bytes):
+    """Send header and payload in one syscall when possible, without joining them"""
+    header = RPC_FRAME.pack(request_id, len(payload))
+    sent = sock.sendmsg([header, payload])
+    if sent < len(header):
+        sock.sendall(header[sent:])
+        sent = len(header)
+    if sent - len(header) < len(payload):
+        sock.sendall(memoryview(payload)[sent - len(header):])
+
+def _raise_remote(name: str, message: str):
+    """Re-raise a peer's exception as the builtin type when there is one"""
+    error = getattr(builtins, name, None)
+    if not (isinstance(error, type) and issubclass(error, Exception)):
+        error = RuntimeError
+    raise error(message)
+
+class _Deadlines:
+    """One thread failing RPC requests still unanswered at their deadline.
+
+    Entries hold the connection and request id, not the future, so a
+    result is not kept alive until its deadline passes. Answered requests
+    cancel their entry; cancelled entries are skipped when they surface
+    and the heap is rebuilt once they make up most of it.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.cancelled = 0
+        self.cond = threading.Condition()
+        self.ids = count()
+        self.thread = None
+
+    def add(self, seconds: float, connection: '_RpcConnection', request_id: int) -> list:
+        entry = [time.monotonic() + seconds, next(self.ids), connection, request_id]
+        with self.cond:
+            heapq.heappush(self.heap, entry)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return entry
+
+    def cancel(self, entry: list):
+        with self.cond:
+            if entry[2] is None:
+                return
+            entry[2] = None  # drops the connection reference right away
+            self.cancelled += 1
+            if self.cancelled > 64 and self.cancelled * 2 > len(self.heap):
+                self.heap = [e for e in self.heap if e[2] is not None]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                deadline, _, connection, request_id = self.heap[0]
+                if connection is None:
+                    heapq.heappop(self.heap)
+                    self.cancelled -= 1
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                heapq.heappop(self.heap)
+            connection.expire(request_id)
+
+_DEADLINES = _Deadlines()
+
+class _RpcConnection:
+    """One socket with many requests in flight, matched to replies by id.
+
+    The server's challenge is answered with an HMAC of the shared secret
+    before any request is sent.
+    """
+
+    def __init__(self, address: str, secret: bytes = b'', timeout: Optional[float] = 30.0):
+        host, port = address.rsplit(':', 1)
+        self.sock = socket.create_connection((host, int(port)), timeout=timeout)
+        nonce = _recv_exact(self.sock, RPC_NONCE)
+        self.sock.sendall(_proof(secret, nonce))
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.pending = {}    # request id -> Future
+        self.deadlines = {}  # request id -> _DEADLINES entry
+        self.ids = count()
+        self.closed = False
+        threading.Thread(target=self._read_replies, daemon=True).start()
+
+    def submit(self, calls: list, timeout: Optional[float] = None) -> Future:
+        future = Future()
+        payload = marshal.dumps(calls)
+        with self.send_lock:
+            if self.closed:
+                raise ConnectionError("Connection to peer is closed")
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+            if timeout is not None:  # registered first, so a quick reply finds it to cancel
+                self.deadlines[request_id] = _DEADLINES.add(timeout, self, request_id)
+            _send_frame(self.sock, request_id, payload)
+        return future
+
+    def expire(self, request_id: int):
+        with self.send_lock:
+            future = self.pending.pop(request_id, None)
+            self.deadlines.pop(request_id, None)
+        if future is not None:
+            future.set_exception(TimeoutError("Peer did not answer in time"))
+
+    def _read_replies(self):
+        try:
+            while True:
+                request_id, length = RPC_FRAME.unpack(_recv_exact(self.sock, RPC_FRAME.size))
+                replies = marshal.loads(_recv_exact(self.sock, length))
+                future = self.pending.pop(request_id, None)
+                entry = self.deadlines.pop(request_id, None)
+                if entry is not None:
+                    _DEADLINES.cancel(entry)
+                if future is not None:  # None: expired, the late reply is dropped
+                    future.set_result(replies)
+        except Exception:
+            with self.send_lock:
+                self.closed = True
+                pending, self.pending = self.pending, {}
+                deadlines, self.deadlines = self.deadlines, {}
+            for entry in deadlines.values():
+                _DEADLINES.cancel(entry)
+            for future in pending.values():
+                future.set_exception(ConnectionError("Connection to peer was lost"))
+
+    def close(self):
+        with self.send_lock:
+            self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class RemoteNode:
+    """Client for a peer's RpcServer over a small pool of connections.
+
+    Each submit() sends one frame holding a batch of calls. Any number of
+    frames may be in flight on a connection and replies are matched by
+    request id, so callers pipeline instead of paying a round trip each.
+    A request unanswered after timeout seconds fails with TimeoutError,
+    except for UNBOUNDED ops, which last as long as a data move does.
+    """
+
+    UNBOUNDED = frozenset({'rebalance'})
+
+    def __init__(self, address: str, pool_size: int = 4, secret: Optional[bytes] = None,
+                 timeout: Optional[float] = 30.0):
+        self.address = address
+        self.pool_size = pool_size
+        self.secret = secret or b''
+        self.timeout = timeout
+        self.connections = [None] * pool_size
+        self.lock = threading.Lock()
+        self._next = count()
+
+    def _connection(self) -> _RpcConnection:
+        slot = next(self._next) % self.pool_size
+        with self.lock:
+            connection = self.connections[slot]
+            if connection is None or connection.closed:
+                connection = self.connections[slot] = _RpcConnection(self.address, self.secret, self.timeout)
+            return connection
+
+    def submit(self, calls: List[tuple]) -> Future:
+        """Send (op, args, kwargs) calls as one frame; resolves to (ok, value) replies"""
+        unbounded = any(op in self.UNBOUNDED for op, _, _ in calls)
+        return self._connection().submit(calls, None if unbounded else self.timeout)
+
+    def call_async(self, op: str, *args, **kwargs) -> Future:
+        """Future resolving to one call's result, or raising the peer's error"""
+        outer = Future()
+
+        def unwrap(inner):
+            try:
+                ok, value = inner.result()[0]
+                if not ok:
+                    _raise_remote(*value)
+                outer.set_result(value)
+            except Exception as e:
+                outer.set_exception(e)
+
+        self.submit([(op, args, kwargs)]).add_done_callback(unwrap)
+        return outer
+
+    def call(self, op: str, *args, **kwargs):
+        return self.call_async(op, *args, **kwargs).result()
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections:
+                if connection is not None:
+                    connection.close()
+            self.connections = [None] * self.pool_size
+
+class RpcServer:
+    """Serves a filesystem's operations to its peers over TCP.
+
+    Each connection's frames run on a worker pool, so a pipelining client
+    gets every reply as soon as its batch finishes. ROUTED ops may be
+    forwarded once to the node that owns their path now, so a client with
+    a stale ring still reaches it; every other op, and any op wrapped as
+    ('direct', op, ...), runs on this node only. Payloads are marshal-encoded, so a
+    connection must first prove it knows the shared secret by answering
+    an HMAC challenge; without a secret only loopback binds are allowed.
+    """
+
+    OPS = {
+        'add_file': 'add_file',
+        'read_file': 'read_file',
+        'read_range': 'read_range',
+        'mkdir': 'mkdir',
+        'list_page': '_list_page',
+        'routed_page': '_routed_page',
+        'add_files': 'add_files',
+        'read_files': 'read_files',
+        'list_dirs': '_list_dirs',
+        'ring_join': '_ring_join',
+        'ring_change': '_ring_change',
+        'ring_settle': '_ring_settle',
+        'rebalance': '_rebalance',
+        'adopt_files': '_adopt_files',
+    }
+    ROUTED = frozenset({'add_file', 'read_file', 'read_range', 'mkdir', 'routed_page', 'add_files', 'read_files'})
+
+    def __init__(self, fs: 'DistributedFileSystem', host: str = '127.0.0.1', port: int = 0,
+                 workers: int = 16, secret: Optional[bytes] = None):
+        if not secret and not _is_loopback(host):
+            raise ValueError("Serving beyond loopback requires a cluster secret")
+        self.fs = fs
+        self.secret = secret or b''
+        self.listener = socket.create_server((host, port))
+        self.address = f"{host}:{self.listener.getsockname()[1]}"
+        self.workers = ThreadPoolExecutor(max_workers=workers, initializer=fs._mark_serving)
+        self.connections = set()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return  # listener closed
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections.add(sock)
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock: socket.socket):
+        send_lock = threading.Lock()
+        try:
+            nonce = os.urandom(RPC_NONCE)
+            sock.settimeout(5)
+            sock.sendall(nonce)
+            proof = _recv_exact(sock, len(nonce))
+            sock.settimeout(None)
+            if not hmac.compare_digest(bytes(proof), _proof(self.secret, nonce)):
+                raise ConnectionRefusedError("Bad cluster secret")
+            while True:
+                request_id, length = RPC_FRAME.unpack(_recv_exact(sock, RPC_FRAME.size))
+                calls = marshal.loads(_recv_exact(sock, length))
+                self.workers.submit(self._execute, sock, send_lock, request_id, calls)
+        except (OSError, EOFError, ValueError, RuntimeError):
+            self.connections.discard(sock)
+            sock.close()
+
+    def _execute(self, sock: socket.socket, send_lock: threading.Lock, request_id: int, calls: list):
+        replies = []
+        for op, args, kwargs in calls:
+            try:
+                replies.append((True, self.fs._serve_request(op, args, kwargs)))
+            except Exception as e:
+                replies.append((False, (type(e).__name__, str(e))))
+        payload = marshal.dumps(replies)
+        with send_lock:
+            try:
+                _send_frame(sock, request_id, payload)
+            except OSError:
+                pass  # the client went away; its reader fails the request
+
+    def close(self):
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)  # wakes the accept loop
+        except OSError:
+            pass
+        self.listener.close()
+        for sock in list(self.connections):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.workers.shutdown(wait=False)
 
-@dataclass
-class DirectoryMetadata:
-    children: Dict[str, 'Node']
-    sharded: bool = False
-    shard_keys: List[str] = None
-    sorted: bool = True
+def _routed(fallback: bool = False):
+    """Forward a single-path operation to the node that owns the path.
 
-Node = Union[FileMetadata, DirectoryMetadata]
+    With fallback, a local miss during a rebalance is retried once at the
+    node the handoff ring names, which may not have moved the file yet.
+    """
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, path, *args, **kwargs):
+            node = self._owner(path)
+            if node is not None:
+                return self._distributed_op(node, method.__name__, path, *args, **kwargs)
+            try:
+                return method(self, path, *args, **kwargs)
+            except ValueError:
+                node = self._handoff_owner(path) if fallback else None  # None when serving directly
+                if node is None:
+                    raise
+                return self._distributed_op(node, method.__name__, path, *args, **kwargs)
+        return wrapper
+    return decorate
 
-# ======================
-# Storage Backend Abstraction
-# ======================
+class LocalCluster:
+    """N filesystem nodes in local processes, serving on loopback.
 
-class StorageBackend(ABC):
-    @abstractmethod
-    def read(self, content_hash: str) -> bytes:
-        pass
-    
-    @abstractmethod
-    def write(self, data: bytes) -> str:
-        pass
-    
-    @abstractmethod
-    def delete(self, content_hash: str):
-        pass
+    Unless fs_options name a cluster_secret, a random one is generated and
+    shared by the nodes and client() only.
 
-class MemoryStorage(StorageBackend):
-    def __init__(self):
-        self.store = {}
-        
-    def read(self, content_hash: str) -> bytes:
-        return self.store[content_hash]
-    
-    def write(self, data: bytes) -> str:
-        content_hash = hashlib.sha256(data).hexdigest()
-        self.store[content_hash] = data
-        return content_hash
-    
-    def delete(self, content_hash: str):
-        del self.store[content_hash]
+    Every node has every other node as a peer, so any of them routes
+    correctly. client() returns an in-process filesystem that owns no
+    keys and forwards every file operation. Meant for tests and
+    benchmarks on a single machine.
+    """
 
-class DiskStorage(StorageBackend):
-    def __init__(self, base_path: str = "/tmp/fs_storage"):
-        self.base_path = base_path
-        os.makedirs(base_path, exist_ok=True)
-        
-    def _get_path(self, content_hash: str) -> str:
-        return os.path.join(self.base_path, content_hash[:2], content_hash[2:4], content_hash)
-    
-    def read(self, content_hash: str) -> bytes:
-        with open(self._get_path(content_hash), 'rb') as f:
-            return f.read()
-    
-    def write(self, data: bytes) -> str:
-        content_hash = hashlib.sha256(data).hexdigest()
-        path = self._get_path(content_hash)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        
-        with open(path, 'wb') as f:
-            f.write(data)
-        return content_hash
-    
-    def delete(self, content_hash: str):
-        try:
-            os.remove(self._get_path(content_hash))
-        except FileNotFoundError:
-            pass
+    def __init__(self, nodes: int = 3, **fs_options):
+        self.nodes = nodes
+        fs_options.setdefault('cluster_secret', os.urandom(32))
+        self.fs_options = fs_options
+        self.addresses = []
+        self.processes = []
+        self.pipes = []
 
-# ======================
-# Distributed Components
-# ======================
+    def __enter__(self):
+        return self.start()
 
-class ConsistentHasher:
-    def __init__(self, nodes=None):
-        self.nodes = nodes or []
-        self.ring = OrderedDict()
-        self.virtual_nodes = 256
-        
-        for node in self.nodes:
-            self.add_node(node)
-    
-    def add_node(self, node):
-        for i in range(self.virtual_nodes):
-            virtual_key = f"{node}-{i}"
-            hash_key = int(hashlib.sha1(virtual_key.encode()).hexdigest(), 16)
-            self.ring[hash_key] = node
-    
-    def get_node(self, key: str):
-        if not self.ring:
-            return None
-            
-        hash_key = int(hashlib.sha1(key.encode()).hexdigest(), 16)
-        for node_hash in sorted(self.ring.keys()):
-            if hash_key <= node_hash:
-                return self.ring[node_hash]
-        return self.ring[min(self.ring.keys())]
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self) -> 'LocalCluster':
+        context = multiprocessing.get_context('spawn')  # no locks inherited from our threads
+        for _ in range(self.nodes):
+            ours, theirs = context.Pipe()
+            process = context.Process(target=_run_cluster_node, args=(theirs, self.fs_options), daemon=True)
+            process.start()
+            self.processes.append(process)
+            self.pipes.append(ours)
+        self.addresses = [pipe.recv() for pipe in self.pipes]
+        for pipe in self.pipes:
+            pipe.send(self.addresses)
+        for pipe in self.pipes:
+            pipe.recv()  # peers connected
+        return self
+
+    def client(self, **fs_options) -> 'DistributedFileSystem':
+        fs = DistributedFileSystem(journal=False, cluster_secret=self.fs_options['cluster_secret'], **fs_options)
+        fs.consistent_hasher.remove_node(fs.current_node)
+        for address in self.addresses:
+            fs.add_peer(address)
+        return fs
+
+    def stop(self):
+        for pipe in self.pipes:
+            try:
+                pipe.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.processes, self.pipes, self.addresses = [], [], []
+
+def _run_cluster_node(pipe, fs_options: dict):
+    fs = DistributedFileSystem(**fs_options)
+    address = fs.serve()
+    pipe.send(address)
+    for peer in pipe.recv():
+        if peer != address:
+            fs.add_peer(peer)
+    pipe.send('ready')
+    try:
+        pipe.recv()  # stop message, or EOF if the parent died
+    except EOFError:
+        pass
+    fs.close()
 
 # ======================
 # Main FileSystem Class
 # ======================
 
 class DistributedFileSystem:
-    def __init__(self, storage_backend: StorageBackend = None, shard_threshold=100_000):
-        self.root = DirectoryMetadata(children={})
+    def __init__(self, storage_backend: StorageBackend = None, shard_threshold=100_000,
+                 path_cache_size=100_000, chunk_size=1024 * 1024, shard_count=256,
+                 codec: str = 'zlib', inline_threshold: int = 512, intern_names: bool = True,
+                 journal: bool = True, journal_path: Optional[str] = None, snapshot_every: int = 100_000,
+                 hash_index: bool = True, cluster_secret: Optional[bytes] = None):
+        self.root = DirectoryMetadata()
         self.storage = storage_backend or MemoryStorage()
         self.shard_threshold = shard_threshold
-        self.path_cache = {}
-        self.lock = threading.RLock()
+        self.shard_count = shard_count
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.inline_threshold = inline_threshold
+        self.intern_names = intern_names  # share one str per repeated entry name
+        self.path_cache = PathCache(path_cache_size)
+        self.metrics = Metrics()
+        self.lock = ReadWriteLock(on_wait=lambda seconds: self.metrics.incr('lock_wait_seconds', seconds))
         self.executor = ThreadPoolExecutor(max_workers=64)
+
+        # Blob lifecycle: references from file metadata, plus pins held by
+        # in-flight writes and open readers that keep a blob alive
+        self.blob_refs = {}
+        self.blob_pins = {}
+        self.pin_lock = threading.Lock()
+        self.gc_lock = threading.Lock()
+        self._sweep = None
+
+        # Reverse index: content digest -> path, or set of paths once shared,
+        # with running dedup totals
+        self.hash_index = {} if hash_index else None
+        self.dedup = {'files': 0, 'unique_contents': 0, 'logical_bytes': 0, 'unique_bytes': 0}
         
-        # Distributed components
+        # Distributed components; peers must share cluster_secret
+        self.cluster_secret = cluster_secret
         self.consistent_hasher = ConsistentHasher([socket.gethostname()])
         self.current_node = socket.gethostname()
+        self.peers = {}  # node address -> RemoteNode
+        self.server = None
+        self.handoff = None  # ring before a membership change, until its data has moved
+        self._rpc_local = threading.local()
         
         # Statistics
         self.stats = {
             'operations': 0,
             'cache_hits': 0,
             'compression_ratio': 0,
-            'shards_created': 0
+            'shards_created': 0,
+            'blobs_reclaimed': 0,
+            'bytes_reclaimed': 0,
+            'gc_passes': 0,
+            'recompression_scanned': 0,
+            'recompression_files': 0,
+            'recompression_bytes_saved': 0,
+            'recompression_done': False,
+            'rebalance_files_moved': 0,
+            'rebalance_bytes_moved': 0,
+            'checkpoint_failures': 0
         }
+        self.compression_job = None
+
+        # Metadata persistence: journal next to a persistent backend unless
+        # given a path or disabled
+        self.journal = None
+        self._checkpoint_lock = threading.Lock()
+        journal_path = journal_path or (self.storage.metadata_path() if journal else None)
+        if journal_path:
+            log = MetadataJournal(journal_path, snapshot_every=snapshot_every,
+                                  before_sync=self.storage.flush, after_sync=self._unpin_blobs)
+            self._recover(log)
+            self.journal = log
 
     # ======================
     # Core Operations
     # ======================
 
+    @_instrumented('mkdir')
     def mkdir(self, path: str) -> None:
-        with self.lock:
+        with self.lock.write:
             parent, name = self._resolve_parent_and_name(path)
             if parent is None:
                 if path == '/':
@@ -209,71 +2325,276 @@ class DistributedFileSystem:
             if name in parent.children:
                 return
                 
-            parent.children[name] = DirectoryMetadata(children={})
-            parent.sorted = False
+            parent.children[self._entry_name(name)] = DirectoryMetadata()
+            self._journal_mkdir(path)
             self._invalidate_cache(path)
 
-    def add_file(self, path: str, content: bytes, compress: bool = True) -> None:
-        with self.lock:
-            parent, name = self._resolve_parent_and_name(path)
-            if parent is None:
-                raise ValueError("Parent directory does not exist")
-                
-            if not isinstance(parent, DirectoryMetadata):
-                raise ValueError("Parent is not a directory")
-                
-            if name in parent.children and isinstance(parent.children[name], DirectoryMetadata):
-                raise ValueError("Directory with same name exists")
-                
-            # Compression logic
-            if compress and len(content) > 1024:
-                compressed = zlib.compress(content)
-                if len(compressed) < len(content) * 0.9:  # Only store if worthwhile
-                    content = compressed
-                    compress = True
-                else:
-                    compress = False
-            
-            # Content storage
-            content_hash = self.storage.write(content)
-            
-            # Create file entry
-            parent.children[name] = FileMetadata(
-                content_hash=content_hash,
-                size=len(content),
-                compressed=compress,
-                created_at=time.time(),
-                modified_at=time.time()
-            )
-            parent.sorted = False
-            
-            # Auto-shard if needed
-            if len(parent.children) > self.shard_threshold and not parent.sharded:
-                self._shard_directory(parent)
-                
-            self._invalidate_cache(path)
+        # Directories exist on every node, so any owner can link files into them
+        if not self._routing():
+            return
+        if self._member():
+            futures = [peer.call_async('direct', 'mkdir', path) for peer in self.peers.values()]
+        else:  # a member knows the current peers
+            futures = [self._coordinator().call_async('mkdir', path)]
+        for future in futures:
+            future.result()
+
+    @_instrumented('add_file')
+    @_routed()
+    def add_file(self, path: str, content: bytes, compress: bool = True,
+                 codec: Optional[str] = None) -> None:
+        with self.lock.read:
+            self._file_parent(path)  # fail fast before storing content
+
+        # Compression and blob I/O run outside the metadata lock
+        meta = self._store_content(content, compress, codec)
+        try:
+            self._link_file(path, meta)
+        finally:
+            self._unpin_blobs(self._blob_hashes(meta))
 
+    @_instrumented('read_file')
+    @_routed(fallback=True)
     def read_file(self, path: str) -> bytes:
-        with self.lock:
+        with self.lock.read:
             node = self._resolve_path(path)
             if not isinstance(node, FileMetadata):
                 raise ValueError("Path is not a file")
-                
-            content = self.storage.read(node.content_hash)
-            return zlib.decompress(content) if node.compressed else content
+            hashes = self._blob_hashes(node)
+            self._pin_blobs(hashes)
 
-    def list_dir(self, path: str) -> List[str]:
-        with self.lock:
+        # Blobs are immutable and pinned, so I/O and decompression need no lock
+        try:
+            return self._read_content(node)
+        finally:
+            self._unpin_blobs(hashes)
+
+    @_instrumented('open_write')
+    def open_write(self, path: str, compress: bool = True,
+                   codec: Optional[str] = None) -> ChunkedWriter:
+        """Open a chunked write stream; the file is created on close.
+
+        Streams are local: in a cluster the path must be owned by this node.
+        """
+        self._require_local(path)
+        with self.lock.read:
+            self._file_parent(path)
+        return ChunkedWriter(self, path, compress, codec)
+
+    @_instrumented('open_read')
+    def open_read(self, path: str) -> ChunkedReader:
+        """Open a seekable read stream over the file's chunks"""
+        return self._open_reader(path)
+
+    def _open_reader(self, path: str) -> ChunkedReader:
+        self._require_local(path)
+        with self.lock.read:
             node = self._resolve_path(path)
-            if not isinstance(node, DirectoryMetadata):
-                return [path.split('/')[-1]]
-                
-            # Lazy sorting
-            if not node.sorted:
-                node.children = dict(sorted(node.children.items()))
-                node.sorted = True
-                
-            return list(node.children.keys())
+            if not isinstance(node, FileMetadata):
+                raise ValueError("Path is not a file")
+            self._pin_blobs(self._blob_hashes(node))
+        return ChunkedReader(self, node)
+
+    @_instrumented('read_range')
+    @_routed(fallback=True)
+    def read_range(self, path: str, offset: int, length: int) -> bytes:
+        """Read a byte range, decompressing only the chunks it overlaps"""
+        with self._open_reader(path) as reader:  # counted as read_range only
+            return reader.read_range(offset, length)
+
+    @_instrumented('list_dir')
+    def list_dir(self, path: str, start_after: Optional[str] = None,
+                 limit: Optional[int] = None) -> List[str]:
+        """List names in order, optionally one page after start_after"""
+        page = self._routed_page(path, start_after, limit)
+        return [path.split('/')[-1]] if page is None else page
+
+    def iter_dir(self, path: str, start_after: Optional[str] = None, page_size: int = 1000):
+        """Lazily yield names in order, taking the lock once per page"""
+        while True:
+            page = self._routed_page(path, start_after, page_size)
+            if page is None:
+                yield path.split('/')[-1]
+                return
+            yield from page
+            if len(page) < page_size:
+                return
+            start_after = page[-1]
+
+    def walk(self, path: str = '/', pattern: Optional[str] = None, min_size: Optional[int] = None,
+             modified_after: Optional[float] = None, page_size: int = 1000):
+        """Lazily yield (path, FileMetadata) for files under path, in path order.
+
+        A single depth-first traversal: each directory is read one page of
+        page_size entries at a time under the read lock, and the filters
+        (fnmatch pattern on the name, size, mtime) run inside that section,
+        so only matches are copied out. No lock is held between pages. In a
+        cluster this covers the files stored on this node.
+        """
+        match = self._walk_filter(pattern, min_size, modified_after)
+        with self.lock.read:
+            root = self._resolve_path(path)
+        if isinstance(root, FileMetadata):
+            if match(path.split('/')[-1], root):
+                yield path, root
+            return
+        if root is None:
+            raise ValueError("Path does not exist")
+
+        stack = [self._walk_pages(path.rstrip('/'), root, match, page_size)]
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop()
+            elif isinstance(entry[1], DirectoryMetadata):
+                stack.append(self._walk_pages(entry[0], entry[1], match, page_size))
+            else:
+                yield entry
+
+    def _walk_pages(self, prefix: str, directory: DirectoryMetadata, match, page_size: int):
+        """Yield a directory's subdirectories and matching files, one locked page at a time"""
+        start_after = None
+        while True:
+            with self.lock.read:
+                children = directory.children
+                names = list(islice(children.irange(start_after), page_size))
+                page = [(f"{prefix}/{name}", node) for name, node in zip(names, map(children.get, names))
+                        if isinstance(node, DirectoryMetadata) or match(name, node)]
+            yield from page
+            if len(names) < page_size:
+                return
+            start_after = names[-1]
+
+    @staticmethod
+    def _walk_filter(pattern: Optional[str], min_size: Optional[int], modified_after: Optional[float]):
+        name_matches = re.compile(fnmatch.translate(pattern)).match if pattern else None
+
+        def match(name: str, meta: FileMetadata) -> bool:
+            return ((name_matches is None or name_matches(name) is not None) and
+                    (min_size is None or meta.size >= min_size) and
+                    (modified_after is None or meta.modified_at > modified_after))
+        return match
+
+    # ======================
+    # Batch Operations
+    # ======================
+
+    @_instrumented('add_files')
+    def add_files(self, files: Dict[str, bytes], compress: bool = True,
+                  codec: Optional[str] = None) -> None:
+        """Store many files in parallel and commit them in one write section"""
+        self.add_files_async(files, compress, codec).result()
+
+    @_instrumented('read_files')
+    def read_files(self, paths: List[str]) -> Dict[str, bytes]:
+        """Read many files in parallel; returns {path: content}"""
+        return self.read_files_async(paths).result()
+
+    def add_files_async(self, files: Dict[str, bytes], compress: bool = True,
+                        codec: Optional[str] = None) -> Future:
+        """Future-returning add_files; resolves to None once all are linked.
+
+        Every parent is validated up front, so bad paths raise here before
+        any content is written. In a cluster, files owned by peers are sent
+        to them in batches; each node commits its share independently.
+        """
+        items = list(files.items())
+        with self.lock.read:
+            for path, _ in items:
+                self._file_parent(path)
+        items, remote = self._partition(items)
+
+        def store(batch):
+            stored = []
+            try:
+                for path, content in batch:
+                    stored.append((path, self._store_content(content, compress, codec)))
+            except Exception:
+                self._unpin_blobs(h for _, meta in stored for h in self._blob_hashes(meta))
+                raise
+            return stored
+
+        def link(futures):
+            stored = [entry for f in futures[:len(local)] if not f.exception() for entry in f.result()]
+            try:
+                for f in futures:
+                    f.result()  # surface the first failed batch
+                self._link_files(stored)
+            finally:
+                self._unpin_blobs(h for _, meta in stored for h in self._blob_hashes(meta))
+
+        local = [self.executor.submit(store, batch) for batch in self._batches(items)]
+        forwarded = [self._forward(node, 'add_files', dict(batch), compress, codec)
+                     for node, group in remote.items() for batch in self._batches(group)]
+        return self._gather(local + forwarded, link)
+
+    def read_files_async(self, paths: List[str]) -> Future:
+        """Future-returning read_files; resolves to {path: content}"""
+        paths, remote = self._partition(paths)
+        with self.lock.read:
+            nodes = []
+            for path in paths:
+                node = self._resolve_path(path)
+                if not isinstance(node, FileMetadata):
+                    fallback = self._handoff_owner(path)  # not moved here yet
+                    if fallback is None:
+                        raise ValueError(f"Path is not a file: {path}")
+                    remote.setdefault(fallback, []).append(path)
+                    continue
+                nodes.append((path, node))
+            pinned = [h for _, node in nodes for h in self._blob_hashes(node)]
+            self._pin_blobs(pinned)
+
+        def read(batch):
+            return [(path, self._read_content(node)) for path, node in batch]
+
+        def collect(futures):
+            try:
+                contents = {}
+                for f in futures:
+                    contents.update(f.result())
+                return contents
+            finally:
+                self._unpin_blobs(pinned)
+
+        local = [self.executor.submit(read, batch) for batch in self._batches(nodes)]
+        forwarded = [self._forward(node, 'read_files', batch)
+                     for node, group in remote.items() for batch in self._batches(group)]
+        return self._gather(local + forwarded, collect)
+
+    @staticmethod
+    def _batches(items: list, size: int = 64):
+        """Group small per-file jobs so executor overhead stays amortized"""
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def _gather(self, futures: List[Future], finish) -> Future:
+        """Future resolving to finish(futures) once every future is done.
+
+        Completion is chained by callbacks instead of a waiting worker, so
+        batches can be issued from inside the executor without deadlock.
+        """
+        outer = Future()
+        remaining = [len(futures)]
+        counter_lock = threading.Lock()
+
+        def complete():
+            try:
+                outer.set_result(finish(futures))
+            except Exception as e:
+                outer.set_exception(e)
+
+        def on_done(_):
+            with counter_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            complete()
+
+        if not futures:
+            complete()
+        for future in futures:
+            future.add_done_callback(on_done)
+        return outer
 
     # ======================
     # Advanced Features
@@ -281,23 +2602,23 @@ class DistributedFileSystem:
 
     def _shard_directory(self, dir_node: DirectoryMetadata):
         """Convert directory to sharded representation"""
+        dir_node.children = ShardedChildren(dir_node.children, self.shard_count)
         dir_node.sharded = True
-        dir_node.shard_keys = []
-        
-        # Create 256 sub-shards (00-ff)
-        for i in range(256):
-            shard_key = f"{i:02x}"
-            dir_node.shard_keys.append(shard_key)
-            
+
+        # One shard key per sub-map (00-ff for the default 256)
+        dir_node.shard_keys = [f"{i:02x}" for i in range(self.shard_count)]
+
         self.stats['shards_created'] += 1
         self._invalidate_cache_for_parents(dir_node)
 
     def _resolve_path(self, path: str) -> Optional[Node]:
         """Resolve path with caching and locking"""
-        with self.lock:
-            if path in self.path_cache:
-                self.stats['cache_hits'] += 1
-                return self.path_cache[path]
+        with self.lock.read:
+            cached = self.path_cache.get(path)
+            if cached is not None:
+                self.metrics.incr('cache_hits')
+                return cached
+            self.metrics.incr('cache_misses')
                 
             if path == '/':
                 return self.root
@@ -314,7 +2635,7 @@ class DistributedFileSystem:
                     
                 current = current.children[part]
                 
-            self.path_cache[path] = current
+            self.path_cache.put(path, current)
             return current
 
     def _resolve_parent_and_name(self, path: str):
@@ -328,50 +2649,753 @@ class DistributedFileSystem:
         parent = self._resolve_path(parent_path)
         return parent, name
 
+    def _list_page(self, path: str, start_after: Optional[str], limit: Optional[int]):
+        """Return up to limit child names after start_after, or None if not a directory"""
+        with self.lock.read:
+            node = self._resolve_path(path)
+            if not isinstance(node, DirectoryMetadata):
+                return None
+            if start_after is None and limit is None:
+                return list(node.children)
+            return list(islice(node.children.irange(start_after), limit))
+
+    def _list_entries(self, path: str, start_after: Optional[str], limit: int):
+        """Return up to limit (name, node) pairs after start_after, or None if not a directory"""
+        with self.lock.read:
+            node = self._resolve_path(path)
+            if not isinstance(node, DirectoryMetadata):
+                return None
+            children = node.children
+            return [(name, children[name]) for name in islice(children.irange(start_after), limit)]
+
+    def _file_parent(self, path: str):
+        """Resolve and validate the parent directory for a file path"""
+        parent, name = self._resolve_parent_and_name(path)
+        if parent is None:
+            raise ValueError("Parent directory does not exist")
+
+        if not isinstance(parent, DirectoryMetadata):
+            raise ValueError("Parent is not a directory")
+
+        if name in parent.children and isinstance(parent.children[name], DirectoryMetadata):
+            raise ValueError("Directory with same name exists")
+        return parent, name
+
+    def _link_file(self, path: str, meta: FileMetadata):
+        """Attach file metadata at path once its content is stored"""
+        with self.lock.write:
+            parent, name = self._file_parent(path)
+            self._retain_blobs(meta)
+            previous = parent.children.get(name)
+            parent.children[self._entry_name(name)] = meta
+            freed = []
+            if isinstance(previous, FileMetadata):
+                self._unindex_path(path, previous)
+                freed = self._release_blobs(previous)
+            self._index_path(path, meta)
+            self._journal_link(path, meta, freed)
+
+            # Auto-shard if needed
+            if len(parent.children) > self.shard_threshold and not parent.sharded:
+                self._shard_directory(parent)
+
+            self._invalidate_cache(path)
+
+    def _unlink_file(self, path: str, expected: Optional[FileMetadata] = None) -> bool:
+        """Detach a file (only if it is still expected, when given) and release its blobs"""
+        with self.lock.write:
+            parent, name = self._resolve_parent_and_name(path)
+            if not isinstance(parent, DirectoryMetadata):
+                return False
+            node = parent.children.get(name)
+            if not isinstance(node, FileMetadata) or (expected is not None and node is not expected):
+                return False
+            del parent.children[name]
+            self._unindex_path(path, node)
+            self._journal_unlink(path, self._release_blobs(node))
+            self._invalidate_cache(path)
+            return True
+
+    def _entry_name(self, name: str) -> str:
+        return sys.intern(name) if self.intern_names else name
+
+    def _swap_files(self, swaps: List[Tuple[str, FileMetadata, FileMetadata]]) -> List[bool]:
+        """Replace expected metadata with new metadata, skipping changed files"""
+        results = []
+        with self.lock.write:
+            for path, expected, new in swaps:
+                parent, name = self._resolve_parent_and_name(path)
+                if not isinstance(parent, DirectoryMetadata) or parent.children.get(name) is not expected:
+                    results.append(False)
+                    continue
+                self._retain_blobs(new)
+                parent.children[name] = new
+                self._unindex_path(path, expected)
+                self._index_path(path, new)
+                self._journal_link(path, new, self._release_blobs(expected))
+                self._invalidate_cache(path)
+                results.append(True)
+        return results
+
+    def _link_files(self, entries: List[Tuple[str, FileMetadata]]):
+        """Attach many files in a single write section"""
+        with self.lock.write:
+            for path, meta in entries:
+                self._link_file(path, meta)
+
+    def _store_content(self, content: bytes, compress: bool,
+                       codec: Optional[str] = None) -> FileMetadata:
+        """Compress and write content to storage, leaving its blob pinned.
+
+        Content at or below inline_threshold is kept in the metadata and
+        never touches the storage backend.
+        """
+        if len(content) <= self.inline_threshold:
+            return self._inline_meta(content)
+        codec = codec or self.codec
+        payload, compressed = self._encode(content, compress, codec)
+        now = time.time()
+        return FileMetadata(
+            digest=bytes.fromhex(self._store_payload(payload)),
+            size=len(content),
+            compressed=compressed,
+            created_at=now,
+            modified_at=now,
+            codec=codec if compressed else 'none'
+        )
+
+    def _inline_meta(self, content: bytes) -> FileMetadata:
+        self.metrics.incr('bytes_inline', len(content))
+        now = time.time()
+        return FileMetadata(
+            digest=b'',
+            size=len(content),
+            compressed=False,
+            created_at=now,
+            modified_at=now,
+            codec='none',
+            inline=bytes(content)
+        )
+
+    def _read_content(self, node: FileMetadata) -> bytes:
+        if node.inline is not None:
+            return node.inline
+        if node.chunks:
+            return b''.join(self._decode(self.storage.read(h), c, node.codec) for h, _, c in node.chunks)
+        return self._decode(self.storage.read(node.content_hash), node.compressed, node.codec)
+
+    def _encode(self, content: bytes, compress: bool, codec: Optional[str] = None):
+        """Return (payload, compressed) for content about to be stored"""
+        codec = CODECS[codec or self.codec]
+        if compress and codec.name != 'none' and len(content) > 1024 and looks_compressible(content):
+            encoded = codec.compress(content)
+            if len(encoded) < len(content) * 0.9:  # Only store if worthwhile
+                self.metrics.incr('bytes_before_compression', len(content))
+                self.metrics.incr('bytes_after_compression', len(encoded))
+                return encoded, True
+        self.metrics.incr('bytes_stored_raw', len(content))
+        return content, False
+
+    def _decode(self, payload: bytes, compressed: bool, codec: str = 'zlib') -> bytes:
+        return CODECS[codec].decompress(payload) if compressed else payload
+
     def _invalidate_cache(self, path: str):
         """Invalidate cache for path and all its children"""
-        keys_to_remove = [p for p in self.path_cache if p.startswith(path)]
-        for key in keys_to_remove:
-            del self.path_cache[key]
+        self.path_cache.invalidate(path)
 
     def _invalidate_cache_for_parents(self, node: Node):
         """Walk up the tree to invalidate parent caches"""
         # Implementation would track parent pointers
         pass
 
+    # ======================
+    # Blob Lifecycle
+    # ======================
+
+    @staticmethod
+    def _blob_hashes(meta: FileMetadata) -> List[str]:
+        if meta.inline is not None:
+            return []
+        return [c[0] for c in meta.chunks] if meta.chunks else [meta.content_hash]
+
+    def _store_payload(self, payload: bytes) -> str:
+        """Pin, then write a blob; the caller unpins once it is linked.
+
+        Pinning before the write means a concurrent free or sweep can never
+        delete a deduplicated blob between the write and the link.
+        """
+        content_hash = hashlib.sha256(payload).hexdigest()
+        self._pin_blobs([content_hash])
+        try:
+            return self.storage.write(payload, content_hash)
+        except Exception:
+            self._unpin_blobs([content_hash])
+            raise
+
+    def _pin_blobs(self, hashes):
+        with self.pin_lock:
+            for h in hashes:
+                self.blob_pins[h] = self.blob_pins.get(h, 0) + 1
+
+    def _unpin_blobs(self, hashes):
+        with self.pin_lock:
+            for h in hashes:
+                count = self.blob_pins[h] - 1
+                if count:
+                    self.blob_pins[h] = count
+                    continue
+                del self.blob_pins[h]
+                if h not in self.blob_refs:
+                    self._delete_blob(h)
+
+    def _retain_blobs(self, meta: FileMetadata):
+        """Count references from newly linked metadata (write lock held)"""
+        for h in self._blob_hashes(meta):
+            self.blob_refs[h] = self.blob_refs.get(h, 0) + 1
+
+    def _release_blobs(self, meta: FileMetadata) -> List[str]:
+        """Drop references from unlinked metadata; returns the orphans, left pinned.
+
+        The caller journals the unlink with these hashes, and they are
+        unpinned (and deleted unless relinked) only once that record is
+        durable, so a crash never leaves the tree naming a deleted blob.
+        """
+        orphans = []
+        with self.pin_lock:
+            for h in self._blob_hashes(meta):
+                count = self.blob_refs[h] - 1
+                if count:
+                    self.blob_refs[h] = count
+                    continue
+                del self.blob_refs[h]
+                self.blob_pins[h] = self.blob_pins.get(h, 0) + 1
+                orphans.append(h)
+        return orphans
+
+    def _delete_blob(self, content_hash: str) -> int:
+        """Remove a blob from storage (pin lock held)"""
+        freed = self.storage.delete(content_hash) or 0
+        self.stats['blobs_reclaimed'] += 1
+        self.stats['bytes_reclaimed'] += freed
+        return freed
+
+    # ======================
+    # Content Index
+    # ======================
+
+    def paths_for_hash(self, content_hash: str) -> List[str]:
+        """Paths whose content has this hash, without scanning the tree.
+
+        Inline files have no content hash and are not indexed.
+        """
+        if self.hash_index is None:
+            raise ValueError("Content index is disabled")
+        with self.lock.read:
+            held = self.hash_index.get(bytes.fromhex(content_hash))
+            if held is None:
+                return []
+            return [held] if isinstance(held, str) else sorted(held)
+
+    def dedup_stats(self) -> Dict:
+        """Deduplication totals kept current on every link, O(1) to read.
+
+        logical_bytes counts every indexed file, unique_bytes each distinct
+        content once; dedup_ratio is logical over unique (1.0 = no sharing).
+        """
+        with self.lock.read:
+            stats = dict(self.dedup)
+        stats['bytes_saved'] = stats['logical_bytes'] - stats['unique_bytes']
+        stats['dedup_ratio'] = stats['logical_bytes'] / stats['unique_bytes'] if stats['unique_bytes'] else 1.0
+        return stats
+
+    def _index_path(self, path: str, meta: FileMetadata):
+        """Record path under its content digest (write lock held)"""
+        if self.hash_index is None or meta.inline is not None:
+            return
+        held = self.hash_index.get(meta.digest)
+        if held is None:
+            # A lone path is stored bare; the set is only built once content is shared
+            self.hash_index[meta.digest] = path
+            self.dedup['unique_contents'] += 1
+            self.dedup['unique_bytes'] += meta.size
+        elif isinstance(held, str):
+            if held == path:
+                return
+            self.hash_index[meta.digest] = {held, path}
+        elif path in held:
+            return
+        else:
+            held.add(path)
+        self.dedup['files'] += 1
+        self.dedup['logical_bytes'] += meta.size
+
+    def _unindex_path(self, path: str, meta: FileMetadata):
+        """Drop path from its content digest's entry (write lock held)"""
+        if self.hash_index is None or meta.inline is not None:
+            return
+        held = self.hash_index.get(meta.digest)
+        if isinstance(held, str) and held == path:
+            del self.hash_index[meta.digest]
+            self.dedup['unique_contents'] -= 1
+            self.dedup['unique_bytes'] -= meta.size
+        elif isinstance(held, set) and path in held:
+            held.remove(path)
+            if len(held) == 1:
+                self.hash_index[meta.digest] = held.pop()
+        else:
+            return
+        self.dedup['files'] -= 1
+        self.dedup['logical_bytes'] -= meta.size
+
+    # ======================
+    # Persistence
+    # ======================
+
+    def checkpoint(self) -> int:
+        """Snapshot the tree and drop the journal it covers; returns snapshot bytes.
+
+        Writers are held off while the tree is encoded, not while the
+        snapshot is written and fsynced.
+        """
+        if self.journal is None:
+            raise ValueError("No metadata journal configured")
+        with self._checkpoint_lock:
+            with self.lock.read:
+                generation = self.journal.rotate()
+                parts, entries = self.journal.encode_tree(self.root)
+            return self.journal.write_snapshot(generation, parts, entries)
+
+    def _schedule_checkpoint(self):
+        try:
+            self.executor.submit(self.checkpoint).add_done_callback(self._checkpoint_done)
+        except RuntimeError:  # executor shut down
+            self._checkpoint_failed()
+
+    def _checkpoint_done(self, future: Future):
+        if future.exception() is not None:
+            self._checkpoint_failed()
+
+    def _checkpoint_failed(self):
+        """Count the failure and re-arm the trigger so the next append retries"""
+        self.stats['checkpoint_failures'] += 1
+        journal = self.journal
+        if journal is not None:
+            with journal.lock:
+                journal.checkpoint_pending = False
+
+    def _journal_mkdir(self, path: str):
+        if self.journal is not None and self.journal.log_mkdir(path):
+            self._schedule_checkpoint()
+
+    def _journal_link(self, path: str, meta: FileMetadata, freed: List[str] = ()):
+        if self.journal is None:
+            self._unpin_blobs(freed)
+        elif self.journal.log_link(path, meta, freed):
+            self._schedule_checkpoint()
+
+    def _journal_unlink(self, path: str, freed: List[str] = ()):
+        if self.journal is None:
+            self._unpin_blobs(freed)
+        elif self.journal.log_unlink(path, freed):
+            self._schedule_checkpoint()
+
+    def _recover(self, journal: MetadataJournal):
+        """Load the snapshot, rebuild refcounts, the content index and shards, then replay the tail"""
+        root, records = journal.recover(self._entry_name)
+        if root is not None:
+            self.root = root
+            stack = [('', root)]
+            while stack:
+                prefix, directory = stack.pop()
+                for name, node in directory.children.items():
+                    if isinstance(node, DirectoryMetadata):
+                        stack.append((f"{prefix}/{name}", node))
+                    else:
+                        self._retain_blobs(node)
+                        self._index_path(f"{prefix}/{name}", node)
+                if len(directory.children) > self.shard_threshold:
+                    self._shard_directory(directory)
+
+        for op, path, meta in records:
+            if op == MetadataJournal.MKDIR:
+                self.mkdir(path)
+            elif op == MetadataJournal.LINK:
+                self._link_file(path, meta)
+            else:
+                self._unlink_file(path)
+
     # ======================
     # Distributed Operations
     # ======================
 
+    def serve(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Accept RPCs from peers; this node joins the ring as host:port"""
+        self.server = RpcServer(self, host, port, secret=self.cluster_secret)
+        self.consistent_hasher.remove_node(self.current_node)
+        self.current_node = self.server.address
+        self.consistent_hasher.add_node(self.current_node)
+        return self.current_node
+
+    def add_peer(self, address: str):
+        """Route the peer's share of the ring to it from now on"""
+        self.peers[address] = self._remote(address)
+        self.consistent_hasher.add_node(address)
+
+    def _remote(self, address: str) -> RemoteNode:
+        return RemoteNode(address, secret=self.cluster_secret)
+
+    def close(self):
+        """Stop serving and recompressing, drop peer connections and close the journal"""
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.compression_job is not None:
+            self.compression_job.pause()
+        for peer in self.peers.values():
+            peer.close()
+        with self.lock.write:  # no mutation can be mid-append
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
     def _locate_shard(self, path: str) -> str:
         """Find which node should handle this path"""
         return self.consistent_hasher.get_node(path)
 
-    def _distributed_op(self, op, path: str):
+    def _mark_serving(self):
+        """Run by RPC worker threads: what they forward is served directly"""
+        self._rpc_local.serving = True
+
+    def _serve_request(self, op: str, args: tuple, kwargs: dict):
+        """Run one peer request; only plain ROUTED ops may route further"""
+        direct = op == 'direct'
+        if direct:
+            op, args = args[0], args[1:]
+        self._rpc_local.direct = direct or op not in RpcServer.ROUTED
+        return getattr(self, RpcServer.OPS[op])(*args, **kwargs)
+
+    def _routing(self) -> bool:
+        return bool(self.peers) and not getattr(self._rpc_local, 'direct', False)
+
+    def _member(self) -> bool:
+        """Whether this node owns part of the ring; clients own none"""
+        return self.current_node in self.consistent_hasher.nodes
+
+    def _coordinator(self) -> 'RemoteNode':
+        """The member a client asks to run cluster-wide operations, whose ring is current"""
+        return next(iter(self.peers.values()))
+
+    def _forward(self, node: str, op: str, *args, **kwargs) -> Future:
+        """Call op on a peer; a request being served is forwarded at most once"""
+        if getattr(self._rpc_local, 'serving', False):
+            return self.peers[node].call_async('direct', op, *args, **kwargs)
+        return self.peers[node].call_async(op, *args, **kwargs)
+
+    def _owner(self, path: str) -> Optional[str]:
+        """The peer that owns path, or None if this node handles it"""
+        if not self._routing():
+            return None
+        node = self._locate_shard(path)
+        return None if node == self.current_node else node
+
+    def _require_local(self, path: str):
+        node = self._owner(path)
+        if node is not None:
+            raise ValueError(f"Path is owned by {node}; streams are local only")
+
+    def _distributed_op(self, node: str, op: str, path: str, *args, **kwargs):
         """Route operation to correct node"""
-        target_node = self._locate_shard(path)
-        if target_node != self.current_node:
-            # In real implementation, would use network RPC
-            raise NotImplementedError("Cross-node operations not implemented")
-        return op()
+        return self._forward(node, op, path, *args, **kwargs).result()
+
+    def _partition(self, items: list):
+        """Split paths or (path, value) pairs into ours and {peer: theirs}"""
+        if not self._routing():
+            return items, {}
+        paths = [item if isinstance(item, str) else item[0] for item in items]
+        local, remote = [], {}
+        for item, node in zip(items, self.consistent_hasher.get_nodes_bulk(paths)):
+            if node == self.current_node:
+                local.append(item)
+            else:
+                remote.setdefault(node, []).append(item)
+        return local, remote
+
+    def _routed_page(self, path: str, start_after: Optional[str], limit: Optional[int]):
+        """_list_page merged across the cluster; directories appear once"""
+        if not self._routing():
+            return self._list_page(path, start_after, limit)
+        if not self._member():  # our peer list may predate a membership change
+            return self._coordinator().call('routed_page', path, start_after, limit)
+        futures = [peer.call_async('list_page', path, start_after, limit) for peer in self.peers.values()]
+        pages = [self._list_page(path, start_after, limit)] + [f.result() for f in futures]
+        pages = [page for page in pages if page is not None]
+        if not pages:
+            return None
+        merged = (name for name, _ in groupby(heapq.merge(*pages)))
+        return list(islice(merged, limit))
+
+    def _handoff_owner(self, path: str) -> Optional[str]:
+        """Another node that may hold path while a rebalance is in flight"""
+        if self.handoff is None or not self._routing():
+            return None
+        for ring in (self.handoff, self.consistent_hasher):
+            node = ring.get_node(path)
+            if node != self.current_node and node in self.peers:
+                return node
+        return None
+
+    # ======================
+    # Rebalancing
+    # ======================
+
+    def add_node(self, address: str) -> Dict[str, int]:
+        """Join a serving node to the ring and stream it the arcs it now owns.
+
+        The new node first copies the directory tree, then every member
+        switches to the new ring while keeping the old one as a handoff:
+        reads that miss at a new owner are served by the old owner until
+        the data has moved. Returns the files and bytes moved.
+        """
+        members = list(self.consistent_hasher.nodes)
+        self._on(address, 'ring_join', members).result()
+        self._on_all(set(members) | {self.current_node}, 'ring_change', 'add', address)
+        moved = self._on_all(members, 'rebalance')
+        self._on_all((set(members) | {address}) - {self.current_node}, 'ring_settle')
+        self._ring_settle()
+        return {key: sum(m[key] for m in moved) for key in ('files_moved', 'bytes_moved')}
+
+    def remove_node(self, address: str) -> Dict[str, int]:
+        """Drain a node's files to their new owners and drop it from the ring"""
+        everyone = set(self.consistent_hasher.nodes) | {self.current_node}
+        self._on_all(everyone, 'ring_change', 'remove', address)
+        moved = self._on(address, 'rebalance').result()
+        self._on_all(everyone - {self.current_node}, 'ring_settle')
+        self._ring_settle()  # last, as it closes our connection to the leaving node
+        return moved
+
+    def _on(self, node: str, op: str, *args) -> Future:
+        """Run a cluster op on node: locally, or over RPC"""
+        if node == self.current_node:
+            return self.executor.submit(getattr(self, RpcServer.OPS[op]), *args)
+        if node not in self.peers:
+            self.peers[node] = self._remote(node)
+        return self.peers[node].call_async(op, *args)
+
+    def _on_all(self, nodes, op: str, *args) -> list:
+        return [future.result() for future in [self._on(node, op, *args) for node in nodes]]
+
+    def _ring_join(self, members: List[str]):
+        """Become a member: copy the directories, then adopt the cluster's ring"""
+        for node in members:
+            if node != self.current_node and node not in self.peers:
+                self.peers[node] = self._remote(node)
+        if members:
+            for path in self.peers[members[0]].call('list_dirs'):
+                self.mkdir(path)
+        previous = ConsistentHasher(members, self.consistent_hasher.virtual_nodes)
+        ring = previous.copy()
+        ring.add_node(self.current_node)
+        self.handoff, self.consistent_hasher = previous, ring
+
+    def _ring_change(self, action: str, address: str):
+        """Swap in a ring with address added or removed, keeping the old one as handoff"""
+        ring = self.consistent_hasher.copy()
+        if action == 'add':
+            if address != self.current_node and address not in self.peers:
+                self.peers[address] = self._remote(address)
+            ring.add_node(address)
+        else:
+            ring.remove_node(address)
+        self.handoff, self.consistent_hasher = self.consistent_hasher, ring
+
+    def _ring_settle(self):
+        """Every move is done: drop the handoff ring and peers that left"""
+        self.handoff = None
+        for address in [a for a in self.peers if a not in self.consistent_hasher.nodes]:
+            self.peers.pop(address).close()
+
+    def _rebalance(self, batch_bytes: int = 4 * 1024 * 1024, window: int = 4) -> Dict[str, int]:
+        """Send the files on arcs this node lost to their new owners.
+
+        Only arcs whose owner changed are checked, with one bisect per
+        local path. Files travel in bulk with their stored blobs. They are
+        unlinked here only after the new owner acknowledges them, and only
+        if they did not change meanwhile, so reads keep working throughout.
+        """
+        moved = {'files_moved': 0, 'bytes_moved': 0}
+        if self.handoff is None:
+            return moved
+        arcs = [(start, end, new) for start, end, old, new in self.consistent_hasher.moved_ranges(self.handoff)
+                if old == self.current_node]
+        if not arcs:
+            return moved
+        ends = [end for _, end, _ in arcs]
+
+        batches = {}   # new owner -> ([(path, meta)], [(path, packed meta, blobs)], bytes)
+        in_flight = []
+
+        def send(node):
+            sent, entries, size = batches.pop(node)
+            in_flight.append((self.peers[node].call_async('adopt_files', entries), sent, size))
+            while len(in_flight) > window:
+                settle(*in_flight.pop(0))
+
+        def settle(future, sent, size):
+            future.result()
+            for path, meta in sent:
+                self._unlink_file(path, meta)
+            moved['files_moved'] += len(sent)
+            moved['bytes_moved'] += size
+
+        for path, meta in self.walk('/'):
+            key_hash = ConsistentHasher._hash(path)
+            start, end, new = arcs[bisect_left(ends, key_hash) % len(arcs)]
+            if not (start < key_hash <= end if start < end else key_hash > start or key_hash <= end):
+                continue
+
+            hashes = self._blob_hashes(meta)
+            self._pin_blobs(hashes)
+            try:
+                if self._resolve_path(path) is not meta:
+                    continue  # overwritten since it was listed
+                blobs = [self.storage.read(h) for h in hashes]
+            finally:
+                self._unpin_blobs(hashes)
+
+            packed = MetadataJournal._pack_meta(meta)
+            sent, entries, size = batches.setdefault(new, ([], [], 0))
+            sent.append((path, meta))
+            entries.append((path, packed, blobs))
+            size += len(packed) + sum(len(b) for b in blobs)
+            batches[new] = (sent, entries, size)
+            if size >= batch_bytes:
+                send(new)
+
+        for node in list(batches):
+            send(node)
+        while in_flight:
+            settle(*in_flight.pop(0))
+
+        self.stats['rebalance_files_moved'] += moved['files_moved']
+        self.stats['rebalance_bytes_moved'] += moved['bytes_moved']
+        return moved
+
+    def _adopt_files(self, entries: List[tuple]) -> int:
+        """Store files streamed by a node that lost them; newer local writes win"""
+        adopted = 0
+        for path, packed, blobs in entries:
+            meta, _ = MetadataJournal._unpack_meta(packed, 0)
+            hashes = self._blob_hashes(meta)
+            self._pin_blobs(hashes)
+            try:
+                for content_hash, payload in zip(hashes, blobs):
+                    self.storage.write(payload, content_hash)
+                self._make_parents(path)
+                with self.lock.write:
+                    current = self._resolve_path(path)
+                    if isinstance(current, FileMetadata) and current.modified_at >= meta.modified_at:
+                        continue
+                    self._link_file(path, meta)
+                    adopted += 1
+            finally:
+                self._unpin_blobs(hashes)
+        return adopted
+
+    def _make_parents(self, path: str):
+        parts = path.split('/')[1:-1]
+        for i in range(1, len(parts) + 1):
+            self.mkdir('/' + '/'.join(parts[:i]))
+
+    def _list_dirs(self) -> List[str]:
+        """Every directory path, parents before children"""
+        dirs = []
+        pending = ['/']
+        while pending:
+            directory = pending.pop()
+            prefix = directory.rstrip('/')
+            for name, node in self._list_entries(directory, None, None) or []:
+                if isinstance(node, DirectoryMetadata):
+                    dirs.append(f"{prefix}/{name}")
+                    pending.append(f"{prefix}/{name}")
+        return dirs
 
     # ======================
     # Utility Methods
     # ======================
 
     def get_stats(self) -> Dict:
-        """Return current filesystem statistics"""
-        return self.stats.copy()
+        """Return current filesystem statistics.
 
-    def enable_compression(self, min_size=1024):
-        """Enable compression for files larger than min_size"""
-        # Would scan existing files and compress them
-        pass
+        compression_ratio is compressed/original size over the payloads
+        that were stored compressed (0 when none were); raw payloads are
+        counted separately in bytes_stored_raw. latency maps each
+        operation to its count and p50/p99 in seconds.
+        """
+        stats = self.stats.copy()
+        snapshot = self.metrics.snapshot()
+        counters, latency = snapshot['counters'], snapshot['latency']
 
-    def defragment(self):
-        """Optimize storage layout"""
-        # Would reorganize physical storage
-        pass
+        hits, misses = counters.get('cache_hits', 0), counters.get('cache_misses', 0)
+        before = counters.get('bytes_before_compression', 0)
+        after = counters.get('bytes_after_compression', 0)
+        stats.update(
+            operations=sum(op['count'] for op in latency.values()),
+            op_counts={name: op['count'] for name, op in latency.items()},
+            latency=latency,
+            cache_hits=hits,
+            cache_misses=misses,
+            cache_hit_ratio=hits / (hits + misses) if hits + misses else 0,
+            bytes_before_compression=before,
+            bytes_after_compression=after,
+            bytes_stored_raw=counters.get('bytes_stored_raw', 0),
+            bytes_inline=counters.get('bytes_inline', 0),
+            compression_ratio=after / before if before else 0,
+            lock_wait_seconds=counters.get('lock_wait_seconds', 0.0),
+            dedup=self.dedup_stats()
+        )
+        return stats
+
+    def enable_compression(self, min_size=1024, codec: Optional[str] = None,
+                           bytes_per_second: Optional[float] = None) -> RecompressionJob:
+        """Start (or resume) a background pass compressing raw files of at least min_size"""
+        job = self.compression_job
+        if job is None or job.done or (job.min_size, job.codec) != (min_size, codec or self.codec):
+            if job is not None:
+                job.pause()
+            job = self.compression_job = RecompressionJob(self, min_size, codec, bytes_per_second)
+        job.bytes_per_second = bytes_per_second
+        return job.start()
+
+    def defragment(self, time_budget: Optional[float] = None, batch_size: int = 256) -> int:
+        """Incrementally sweep storage for blobs that no file references.
+
+        Reference counts are the mark set. Each batch of stored hashes is
+        checked and freed under the short pin lock only, so foreground
+        operations keep running. With a time_budget the sweep stops early
+        and resumes where it left off on the next call. Returns the bytes
+        reclaimed by this call.
+        """
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+        reclaimed = 0
+        with self.gc_lock:
+            if self._sweep is None:
+                try:
+                    self._sweep = iter(self.storage.list_hashes())
+                except NotImplementedError:
+                    raise ValueError(f"{type(self.storage).__name__} cannot list its blobs, "
+                                     "so it cannot be defragmented") from None
+
+            while deadline is None or time.monotonic() < deadline:
+                batch = list(islice(self._sweep, batch_size))
+                if not batch:
+                    self._sweep = None
+                    self.stats['gc_passes'] += 1
+                    break
+                with self.pin_lock:
+                    for h in batch:
+                        if h not in self.blob_refs and h not in self.blob_pins:
+                            reclaimed += self._delete_blob(h)
+        return reclaimed
 
 # ======================
 # Example Usage
@@ -389,4 +3413,12 @@ if __name__ == "__main__":
     # Advanced usage
     large_data = os.urandom(10 * 1024 * 1024)  # 10MB random data
     fs.add_file("/data/large.bin", large_data)
+
+    # Streaming usage: only one chunk is held in memory at a time
+    with fs.open_write("/data/stream.bin") as out:
+        for _ in range(10):
+            out.write(os.urandom(1024 * 1024))
+    with fs.open_read("/data/stream.bin") as stream:
+        stream.seek(5 * 1024 * 1024)
+        print(len(stream.read(4096)))  # 4096
     print(f"Compression ratio: {fs.get_stats()['compression_ratio']:.2f}")
\ No newline at end of file
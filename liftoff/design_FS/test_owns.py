@@ -1,7 +1,12 @@
 import pytest
 import os
+import hashlib
+import subprocess
+import sys
 import time
-from filesystem import DistributedFileSystem, DiskStorage  # Assuming your implementation is in filesystem.py
+import threading
+import zlib
+from filesystem import DistributedFileSystem, DiskStorage, PackStorage, Codec, RecompressionJob, register_codec, looks_compressible, ConsistentHasher, PathCache, ReadWriteLock, ShardedChildren, LocalCluster, RemoteNode  # Assuming your implementation is in filesystem.py
 
 @pytest.fixture
 def fs():
@@ -77,6 +82,64 @@ def test_concurrent_access(fs):
     
     assert len(fs.list_dir("/")) == 100
 
+def test_read_write_lock_allows_parallel_readers():
+    import threading
+
+    lock = ReadWriteLock()
+    both_inside = threading.Barrier(2, timeout=5)
+
+    def reader():
+        with lock.read:
+            with lock.read:  # reentrant
+                both_inside.wait()  # deadlocks unless readers overlap
+
+    threads = [threading.Thread(target=reader) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with lock.write:
+        with lock.read:  # writer may also read
+            pass
+    with lock.read:
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+
+def test_concurrent_reads_and_writes(disk_fs):
+    from concurrent.futures import ThreadPoolExecutor
+
+    disk_fs.mkdir("/mixed")
+    for i in range(20):
+        disk_fs.add_file(f"/mixed/f{i}", f"v0-{i}".encode() * 500)
+
+    def worker(i):
+        if i % 4 == 0:
+            disk_fs.add_file(f"/mixed/f{i % 20}", f"v1-{i % 20}".encode() * 500)
+        content = disk_fs.read_file(f"/mixed/f{i % 20}")
+        assert content in (f"v0-{i % 20}".encode() * 500, f"v1-{i % 20}".encode() * 500)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(worker, range(400)))
+
+def test_batch_add_and_read_files(fs):
+    fs.mkdir("/batch")
+    files = {f"/batch/f{i}": f"content_{i}".encode() * (i % 300 + 1) for i in range(500)}
+    fs.add_files(files)
+
+    assert len(fs.list_dir("/batch")) == 500
+    assert fs.read_files(list(files)) == files
+
+    future = fs.add_files_async({"/batch/extra": b"x" * 5000})
+    assert future.result() is None
+    assert fs.read_files_async(["/batch/extra"]).result() == {"/batch/extra": b"x" * 5000}
+
+def test_batch_add_validates_before_writing(fs):
+    with pytest.raises(ValueError, match="Parent directory does not exist"):
+        fs.add_files({"/ok.txt": b"a", "/missing/bad.txt": b"b"})
+    assert fs.list_dir("/") == []
+    assert fs.storage.store == {}
+
 # ======================
 # Sharding Tests
 # ======================
@@ -90,6 +153,107 @@ def test_auto_sharding(fs):
     assert stats['shards_created'] > 0
     assert len(fs.list_dir("/shard_test")) == 1001  # Should still see all files
 
+def test_streaming_write_and_read():
+    fs = DistributedFileSystem(chunk_size=1024)
+    content = b"".join(f"line {i}\n".encode() for i in range(2000))
+
+    with fs.open_write("/stream.txt") as out:
+        for i in range(0, len(content), 700):
+            out.write(content[i:i + 700])
+
+    meta = fs._resolve_path("/stream.txt")
+    assert len(meta.chunks) == -(-len(content) // 1024)
+    assert meta.size == len(content)
+    assert fs.read_file("/stream.txt") == content
+
+    with fs.open_read("/stream.txt") as stream:
+        assert stream.read(10) == content[:10]
+        stream.seek(5000)
+        assert stream.read(3000) == content[5000:8000]
+        stream.seek(-5, os.SEEK_END)
+        assert stream.read() == content[-5:]
+    assert fs.read_range("/stream.txt", 1020, 10) == content[1020:1030]
+
+def test_open_read_on_whole_file(fs):
+    content = b"Hello" * 1000
+    fs.add_file("/whole.txt", content)
+    assert fs.read_range("/whole.txt", 10, 20) == content[10:30]
+
+def test_sharded_directory_splits_children():
+    fs = DistributedFileSystem(shard_threshold=50, shard_count=8)
+    fs.mkdir("/big")
+    names = [f"file_{i:04d}" for i in range(500, 0, -1)]
+    for name in names:
+        fs.add_file(f"/big/{name}", name.encode())
+
+    node = fs._resolve_path("/big")
+    assert node.sharded and isinstance(node.children, ShardedChildren)
+    assert len(node.children) == 500
+    assert sum(len(shard) for shard in node.children.shards) == 500
+    assert fs.list_dir("/big") == sorted(names)
+    assert fs.read_file("/big/file_0042") == b"file_0042"
+
+    fs.add_file("/big/file_9999", b"new")
+    grown = [i for i, shard in enumerate(node.children.shards) if "file_9999" in shard]
+    assert grown == [node.children.shard_index("file_9999")]
+    assert fs.list_dir("/big")[-1] == "file_9999"
+    assert fs.list_dir("/big", start_after="file_0100", limit=3) == ["file_0101", "file_0102", "file_0103"]
+
+    assert fs._unlink_file("/big/file_0101")
+    assert fs.list_dir("/big", start_after="file_0100", limit=2) == ["file_0102", "file_0103"]
+    assert list(node.children) == sorted(set(names) - {"file_0101"} | {"file_9999"})
+
+def test_paginated_listing():
+    fs = DistributedFileSystem()
+    fs.mkdir("/dir")
+    names = [f"n{i:05d}" for i in range(3000)]
+    for name in reversed(names):
+        fs.mkdir(f"/dir/{name}")
+
+    assert fs.list_dir("/dir") == names
+    assert fs.list_dir("/dir", limit=5) == names[:5]
+    assert fs.list_dir("/dir", start_after="n01499", limit=2) == ["n01500", "n01501"]
+    assert fs.list_dir("/dir", start_after="n02999") == []
+    assert fs.list_dir("/dir", start_after="n00999x", limit=1) == ["n01000"]
+    assert list(fs.iter_dir("/dir", page_size=128)) == names
+    assert list(fs.iter_dir("/dir", start_after="n02990")) == names[2991:]
+
+    node = fs._resolve_path("/dir")
+    assert len(node.children.keys_in_order.blocks) > 1
+    del node.children["n01500"]
+    assert fs.list_dir("/dir", start_after="n01499", limit=1) == ["n01501"]
+
+def test_walk_streams_filtered_files_in_path_order(fs):
+    fs.mkdir("/logs")
+    fs.mkdir("/logs/old")
+    fs.add_file("/logs/app.log", b"x" * 100)
+    fs.add_file("/logs/old/app.log", b"x" * 10)
+    fs.add_file("/logs/old/notes.txt", b"x" * 500)
+    fs.add_file("/readme.md", b"hi")
+
+    assert [path for path, _ in fs.walk()] == ["/logs/app.log", "/logs/old/app.log",
+                                             "/logs/old/notes.txt", "/readme.md"]
+    assert [path for path, _ in fs.walk("/logs", pattern="*.log")] == ["/logs/app.log", "/logs/old/app.log"]
+    assert [path for path, _ in fs.walk(min_size=100)] == ["/logs/app.log", "/logs/old/notes.txt"]
+
+    cutoff = fs._resolve_path("/readme.md").modified_at
+    fs.add_file("/logs/old/app.log", b"rotated")
+    assert [path for path, _ in fs.walk(modified_after=cutoff)] == ["/logs/old/app.log"]
+    path, meta = next(fs.walk("/readme.md"))
+    assert path == "/readme.md" and meta.size == 2
+
+def test_walk_holds_lock_per_page_only(fs):
+    fs.mkdir("/many")
+    fs.add_files({f"/many/f{i:04d}": b"x" for i in range(250)})
+    walker = fs.walk("/many", page_size=100)
+    assert next(walker)[0] == "/many/f0000"
+
+    writer = threading.Thread(target=fs.add_file, args=("/many/f0200x", b"new"))
+    writer.start()
+    writer.join(timeout=5)
+    assert not writer.is_alive()  # a suspended walk blocks no writers
+    assert len(list(walker)) == 250  # picks up the file added ahead of it
+
 # ======================
 # Filesystem Semantics Tests
 # ======================
@@ -118,9 +282,494 @@ def test_disk_storage_persistence(tmp_path):
     fs1.add_file("/persistent.txt", b"Hello")
     
     # Second instance
+    fs1.close()
     fs2 = DistributedFileSystem(storage_backend=storage)
     assert fs2.read_file("/persistent.txt") == b"Hello"
 
+def test_journal_recovers_tree_after_restart(tmp_path):
+    def open_fs():
+        return DistributedFileSystem(storage_backend=DiskStorage(base_path=str(tmp_path / "storage")),
+                                     chunk_size=4096)
+
+    fs1 = open_fs()
+    fs1.mkdir("/docs")
+    fs1.add_file("/docs/small.txt", b"inline")
+    fs1.add_file("/docs/big.txt", b"compressible " * 1000)
+    fs1.add_file("/docs/big.txt", b"rewritten " * 1000)  # overwrite frees the old blob
+    with fs1.open_write("/docs/stream.bin") as out:
+        out.write(os.urandom(10_000))
+
+    fs1.close()
+    fs2 = open_fs()
+    assert fs2.list_dir("/docs") == ["big.txt", "small.txt", "stream.bin"]
+    for name in fs2.list_dir("/docs"):
+        path = f"/docs/{name}"
+        assert fs2.read_file(path) == fs1.read_file(path)
+        assert fs2._resolve_path(path) == fs1._resolve_path(path)
+    assert fs2.blob_refs == fs1.blob_refs
+
+def test_checkpoint_bounds_journal_replay(tmp_path):
+    meta_path = str(tmp_path / "meta")
+    fs1 = DistributedFileSystem(journal_path=meta_path)
+    fs1.mkdir("/a")
+    for i in range(50):
+        fs1.add_file(f"/a/f{i}", f"v{i}".encode())
+    assert fs1.checkpoint() > 0
+    fs1.add_file("/a/f0", b"after snapshot")
+    fs1.mkdir("/b")
+
+    journals = [name for name in os.listdir(meta_path) if name.startswith("journal-")]
+    assert len(journals) == 1  # covered generations were dropped
+
+    fs1.close()
+    fs2 = DistributedFileSystem(journal_path=meta_path)
+    assert fs2.journal.records == 2  # only the tail was replayed
+    assert len(fs2.list_dir("/a")) == 50 and fs2.list_dir("/") == ["a", "b"]
+    assert fs2.read_file("/a/f0") == b"after snapshot"
+    assert fs2.read_file("/a/f49") == b"v49"
+
+def test_journal_ignores_torn_tail(tmp_path):
+    meta_path = tmp_path / "meta"
+    fs1 = DistributedFileSystem(journal_path=str(meta_path))
+    fs1.add_file("/kept", b"ok")
+    fs1.close()
+    with open(meta_path / "journal-000001.log", "ab") as f:
+        f.write(b"\x02\x40\x00")  # a record cut off mid-header
+
+    fs2 = DistributedFileSystem(journal_path=str(meta_path))
+    assert fs2.read_file("/kept") == b"ok"
+    fs2.add_file("/next", b"appended after the valid prefix")
+    fs2.close()
+    fs3 = DistributedFileSystem(journal_path=str(meta_path))
+    assert fs3.list_dir("/") == ["kept", "next"]
+
+def test_journal_refuses_second_live_instance(tmp_path):
+    pytest.importorskip("fcntl")
+    storage = DiskStorage(base_path=str(tmp_path / "storage"))
+    fs1 = DistributedFileSystem(storage_backend=storage, inline_threshold=0)
+    fs1.add_file("/b", b"shared blob")
+    with pytest.raises(RuntimeError, match="in use"):
+        DistributedFileSystem(storage_backend=storage)
+    assert fs1.read_file("/b") == b"shared blob"
+
+    fs1.close()
+    fs2 = DistributedFileSystem(storage_backend=storage)
+    assert fs2.read_file("/b") == b"shared blob"
+    fs2.close()
+
+def test_journal_commit_flushes_blobs_first(tmp_path):
+    storage = DiskStorage(base_path=str(tmp_path / "storage"))
+    fs = DistributedFileSystem(storage_backend=storage, inline_threshold=0)
+    fs.add_file("/a", b"durable before its record")
+    fs.journal.flush()
+    assert not storage.unsynced
+    fs.close()
+
+def test_journal_commit_runs_outside_the_tree_lock(tmp_path):
+    storage = DiskStorage(base_path=str(tmp_path / "storage"))
+    fs = DistributedFileSystem(storage_backend=storage, inline_threshold=0)
+    fs.add_file("/a", b"first")
+    fs.journal.flush()
+    reads = []
+
+    def before_sync():  # a reader must get in while the commit is running
+        reader = threading.Thread(target=lambda: reads.append(fs.read_file("/a")))
+        reader.start()
+        reader.join(5)
+        storage.flush()
+
+    fs.journal.before_sync = before_sync
+    fs.journal.sync_every = 1  # every append is due for a commit at once
+    fs.add_file("/b", b"second")
+    fs.journal.flush()
+    assert reads[:1] == [b"first"]
+    fs.close()
+
+def test_freed_blob_outlives_unsynced_unlink(tmp_path):
+    storage = DiskStorage(base_path=str(tmp_path / "storage"))
+    fs = DistributedFileSystem(storage_backend=storage, inline_threshold=0)
+    fs.add_file("/a", b"old content", compress=False)
+    old = hashlib.sha256(b"old content").hexdigest()
+    fs.journal.sync_interval = 60
+    fs.journal.flush()
+    time.sleep(0.1)  # let the flusher start its long wait
+
+    fs.add_file("/a", b"new content", compress=False)
+    assert os.path.exists(storage._get_path(old))  # the overwrite is not durable yet
+    fs.journal.flush()
+    assert not os.path.exists(storage._get_path(old))
+    assert fs.read_file("/a") == b"new content"
+    fs.close()
+
+def test_checkpoint_trigger_survives_long_tail(tmp_path):
+    meta_path = str(tmp_path / "meta")
+    fs1 = DistributedFileSystem(journal_path=meta_path, snapshot_every=1000)
+    for i in range(20):
+        fs1.mkdir(f"/d{i}")
+    fs1.close()
+
+    fs2 = DistributedFileSystem(journal_path=meta_path, snapshot_every=10)
+    assert fs2.journal.records == 20  # already past snapshot_every
+    fs2.mkdir("/next")
+    fs2.executor.shutdown(wait=True)
+    assert fs2.journal.records == 0 and not fs2.journal.checkpoint_pending
+    fs2.close()
+
+def test_disk_storage_mmap_reads(tmp_path):
+    storage = DiskStorage(base_path=str(tmp_path / "storage"), max_mappings=2)
+    data = os.urandom(64 * 1024)
+    content_hash = storage.write(data)
+
+    view = storage.read_view(content_hash)
+    assert isinstance(view, memoryview)
+    assert view == data
+    assert storage.read_range(content_hash, 100, 50) == data[100:150]
+    assert storage.read_view(content_hash).obj is view.obj  # mapping reused
+
+    for i in range(3):
+        storage.read_view(storage.write(f"blob {i}".encode()))
+    assert len(storage.mappings) == 2
+    assert view[:16] == data[:16]  # evicted mapping stays valid while viewed
+
+    storage.delete(content_hash)
+    assert content_hash not in storage.mappings
+    assert storage.read_view(storage.write(b"")) == b""
+
+def test_disk_storage_mappings_stay_under_fd_limit(tmp_path):
+    resource = pytest.importorskip("resource")
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    storage = DiskStorage(base_path=str(tmp_path / "storage"))
+    hashes = [storage.write(f"blob {i}".encode() * 100) for i in range(600)]
+    resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard))
+    try:
+        storage = DiskStorage(base_path=str(tmp_path / "storage"))
+        assert storage.max_mappings == 64
+        held = [storage.read_view(h) for h in hashes[:10]]
+        for i, content_hash in enumerate(hashes):  # twice the fd limit
+            assert storage.read_view(content_hash)[:12] == (f"blob {i}".encode() * 2)[:12]
+        assert len(storage.retired) == 10  # evicted but still viewed
+        assert held[3][:6] == b"blob 3"
+        del held
+        storage.read_view(hashes[0])
+        assert storage.retired == []
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+def test_overwrite_frees_unreferenced_blob():
+    fs = DistributedFileSystem(inline_threshold=0)
+    fs.add_file("/a.txt", b"one")
+    fs.add_file("/b.txt", b"shared")
+    fs.add_file("/c.txt", b"shared")
+    fs.add_file("/a.txt", b"two")
+    fs.add_file("/b.txt", b"other")
+
+    stored = set(fs.storage.store.values())
+    assert stored == {b"two", b"shared", b"other"}
+    stats = fs.get_stats()
+    assert stats['blobs_reclaimed'] == 1
+    assert stats['bytes_reclaimed'] == len(b"one")
+
+def test_content_index_tracks_duplicates():
+    fs = DistributedFileSystem(inline_threshold=0)
+    fs.mkdir("/a")
+    fs.add_file("/a/one", b"shared")
+    fs.add_file("/a/two", b"shared")
+    fs.add_file("/b", b"unique!")
+    digest = fs._resolve_path("/a/one").content_hash
+
+    assert fs.paths_for_hash(digest) == ["/a/one", "/a/two"]
+    stats = fs.dedup_stats()
+    assert (stats['files'], stats['unique_contents']) == (3, 2)
+    assert stats['logical_bytes'] == 19 and stats['bytes_saved'] == 6
+
+    fs.add_file("/a/two", b"unique!")  # overwrite moves the path between hashes
+    fs._unlink_file("/b")
+    assert fs.paths_for_hash(digest) == ["/a/one"]
+    assert fs.paths_for_hash(fs._resolve_path("/a/two").content_hash) == ["/a/two"]
+    assert fs.get_stats()['dedup']['bytes_saved'] == 0
+    assert fs.paths_for_hash("00" * 32) == []
+
+def test_content_index_rebuilt_on_recovery(tmp_path):
+    def open_fs():
+        return DistributedFileSystem(storage_backend=DiskStorage(base_path=str(tmp_path / "storage")),
+                                     inline_threshold=0)
+
+    fs1 = open_fs()
+    fs1.mkdir("/x")
+    fs1.add_file("/x/a", b"dup")
+    fs1.add_file("/x/b", b"dup")
+    fs1.checkpoint()
+    fs1.add_file("/c", b"dup")
+
+    fs1.close()
+    fs2 = open_fs()
+    digest = fs2._resolve_path("/c").content_hash
+    assert fs2.paths_for_hash(digest) == ["/c", "/x/a", "/x/b"]
+    assert fs2.dedup_stats() == fs1.dedup_stats()
+
+    with pytest.raises(ValueError):
+        DistributedFileSystem(hash_index=False).paths_for_hash(digest)
+
+def test_open_reader_keeps_blob_alive():
+    fs = DistributedFileSystem(inline_threshold=0)
+    fs.add_file("/f.txt", b"old content")
+    reader = fs.open_read("/f.txt")
+    fs.add_file("/f.txt", b"new content")
+
+    assert reader.read() == b"old content"
+    reader.close()
+    assert set(fs.storage.store.values()) == {b"new content"}
+
+def test_defragment_sweeps_orphans(disk_fs):
+    disk_fs.add_file("/keep.txt", b"keep me")
+    for i in range(20):
+        disk_fs.storage.write(f"orphan {i:02d}".encode())  # never linked
+
+    assert disk_fs.defragment(time_budget=0) == 0  # no time, no progress
+    assert disk_fs.defragment(batch_size=4) == 20 * len(b"orphan 00")
+    assert sorted(disk_fs.storage.list_hashes()) == disk_fs._blob_hashes(disk_fs._resolve_path("/keep.txt"))
+    assert disk_fs.read_file("/keep.txt") == b"keep me"
+    assert disk_fs.get_stats()['gc_passes'] == 1
+
+def test_defragment_refuses_unlistable_backend():
+    from filesystem import StorageBackend
+
+    class DictStorage(StorageBackend):
+        def __init__(self):
+            self.blobs = {}
+
+        def read(self, content_hash):
+            return self.blobs[content_hash]
+
+        def write(self, data, content_hash=None):
+            content_hash = content_hash or hashlib.sha256(data).hexdigest()
+            self.blobs[content_hash] = data
+            return content_hash
+
+        def delete(self, content_hash):
+            return len(self.blobs.pop(content_hash, b""))
+
+    fs = DistributedFileSystem(storage_backend=DictStorage(), inline_threshold=0)
+    fs.add_file("/a", b"custom backend")
+    with pytest.raises(ValueError, match="cannot list its blobs"):
+        fs.defragment()
+    assert fs.read_file("/a") == b"custom backend"
+
+def test_pack_storage_roundtrip_and_recovery(tmp_path):
+    storage = PackStorage(base_path=str(tmp_path / "packs"), pack_size=64 * 1024, sync_every=8)
+    blobs = {storage.write(f"blob {i} ".encode() * 400): f"blob {i} ".encode() * 400 for i in range(50)}
+
+    assert len(os.listdir(tmp_path / "packs")) > 2  # rolled over several packs
+    for content_hash, data in blobs.items():
+        assert storage.read(content_hash) == data
+    some_hash = next(iter(blobs))
+    assert storage.read_range(some_hash, 7, 12) == blobs[some_hash][7:19]
+    assert storage.write(blobs[some_hash]) == some_hash  # deduplicated
+    assert storage.delete(some_hash) == len(blobs.pop(some_hash))
+    storage.close()
+
+    reopened = PackStorage(base_path=str(tmp_path / "packs"), pack_size=64 * 1024)
+    assert sorted(reopened.list_hashes()) == sorted(blobs)
+    assert all(reopened.read(h) == data for h, data in blobs.items())
+
+def test_pack_storage_survives_process_kill(tmp_path):
+    content = bytes(range(200)) * 3
+    script = (
+        "import os, sys\n"
+        "from filesystem import DistributedFileSystem, PackStorage\n"
+        "fs = DistributedFileSystem(storage_backend=PackStorage(base_path=sys.argv[1]))\n"
+        f"fs.add_file('/a', {content!r})\n"
+        "os._exit(0)\n"  # no close, no flush
+    )
+    subprocess.run([sys.executable, "-c", script, str(tmp_path / "packs")],
+                   cwd=os.path.dirname(os.path.abspath(__file__)), check=True, timeout=60)
+
+    fs = DistributedFileSystem(storage_backend=PackStorage(base_path=str(tmp_path / "packs")))
+    assert fs.read_file("/a") == content
+    fs.close()
+
+def test_pack_storage_rescans_unindexed_tail(tmp_path):
+    storage = PackStorage(base_path=str(tmp_path / "packs"))
+    blobs = {storage.write(f"blob {i} ".encode() * 100): f"blob {i} ".encode() * 100 for i in range(10)}
+    storage.close()
+    index_path = tmp_path / "packs" / "index.log"
+    os.truncate(index_path, os.path.getsize(index_path) - 3 * PackStorage.INDEX_ENTRY.size - 5)
+    with open(tmp_path / "packs" / "pack-000001.dat", "ab") as f:
+        f.write(b"\x00" * 20)  # a torn record header
+
+    reopened = PackStorage(base_path=str(tmp_path / "packs"))
+    assert sorted(reopened.list_hashes()) == sorted(blobs)
+    assert all(reopened.read(h) == data for h, data in blobs.items())
+    extra = reopened.write(b"appended after the torn record")
+    reopened.close()
+    assert extra in PackStorage(base_path=str(tmp_path / "packs")).list_hashes()
+
+def test_pack_storage_compaction(tmp_path):
+    storage = PackStorage(base_path=str(tmp_path / "packs"), pack_size=16 * 1024)
+    hashes = [storage.write(os.urandom(4096)) for _ in range(40)]
+    keep = hashes[::4]
+    for content_hash in hashes:
+        if content_hash not in keep:
+            storage.delete(content_hash)
+    before = sum(storage.pack_sizes.values())
+    kept = {h: storage.read(h) for h in keep}
+
+    assert storage.compact() > 0
+    assert sum(storage.pack_sizes.values()) < before
+    assert all(storage.read(h) == data for h, data in kept.items())
+    storage.close()
+
+    reopened = PackStorage(base_path=str(tmp_path / "packs"), pack_size=16 * 1024)
+    assert sorted(reopened.list_hashes()) == sorted(keep)
+    assert all(reopened.read(h) == data for h, data in kept.items())
+
+def test_filesystem_on_pack_storage(tmp_path):
+    fs = DistributedFileSystem(storage_backend=PackStorage(base_path=str(tmp_path / "packs")),
+                               inline_threshold=0)
+    fs.add_files({f"/f{i}": f"config {i}".encode() for i in range(100)})
+    fs.add_file("/f0", b"replaced")
+    assert fs.read_file("/f0") == b"replaced"
+    assert fs.read_file("/f99") == b"config 99"
+    fs.journal.flush()  # the old blob goes once the overwrite is durable
+    assert fs.get_stats()['blobs_reclaimed'] == 1
+
+def test_per_file_codecs(fs):
+    content = b"repetitive config line\n" * 2000
+    for codec in ("zlib", "zlib-fast", "zlib-max", "bz2", "lzma"):
+        fs.add_file(f"/{codec}.txt", content, codec=codec)
+        meta = fs._resolve_path(f"/{codec}.txt")
+        assert meta.compressed and meta.codec == codec
+        assert fs.read_file(f"/{codec}.txt") == content
+
+    fs.add_file("/raw.txt", content, codec="none")
+    assert fs._resolve_path("/raw.txt").codec == "none"
+
+    with fs.open_write("/stream.txt", codec="lzma") as out:
+        out.write(content)
+    assert fs.read_file("/stream.txt") == content
+
+def test_incompressible_data_skips_compression(fs):
+    random_data = os.urandom(1024 * 1024)
+    assert not looks_compressible(random_data)
+    assert looks_compressible(b"abc" * 100_000)
+
+    fs.add_file("/random.bin", random_data)
+    meta = fs._resolve_path("/random.bin")
+    assert not meta.compressed and meta.codec == "none"
+    assert fs.read_file("/random.bin") == random_data
+
+def test_custom_codec_registration():
+    register_codec(Codec("zlib-3", lambda data: zlib.compress(data, 3), zlib.decompress))
+    fs = DistributedFileSystem(codec="zlib-3")
+    fs.add_file("/f.txt", b"custom codec " * 1000)
+    assert fs._resolve_path("/f.txt").codec == "zlib-3"
+    assert fs.read_file("/f.txt") == b"custom codec " * 1000
+
+def test_background_recompression(fs):
+    fs.mkdir("/logs")
+    fs.mkdir("/logs/old")
+    text = b"GET /index.html 200\n" * 500
+    for i in range(30):
+        fs.add_file(f"/logs/old/{i}.log", text + str(i).encode(), compress=False)
+    fs.add_file("/logs/small.log", b"tiny", compress=False)
+
+    job = fs.enable_compression(min_size=2048)
+    assert job.wait(timeout=10)
+
+    for i in range(30):
+        meta = fs._resolve_path(f"/logs/old/{i}.log")
+        assert meta.compressed and meta.codec == "zlib"
+        assert fs.read_file(f"/logs/old/{i}.log") == text + str(i).encode()
+    assert not fs._resolve_path("/logs/small.log").compressed
+
+    stats = fs.get_stats()
+    assert stats['recompression_files'] == 30
+    assert stats['recompression_bytes_saved'] > 0
+    assert stats['recompression_done']
+    assert stats['blobs_reclaimed'] == 30  # raw blobs freed after the swap
+
+def test_recompression_is_resumable_and_skips_changed_files():
+    fs = DistributedFileSystem()
+    for i in range(10):
+        fs.add_file(f"/f{i}", b"abcdefgh" * 1000, compress=False)
+
+    job = RecompressionJob(fs, page_size=4)
+    job.step()  # first page only
+    assert job.files_compressed == 4 and not job.done
+
+    stale = fs._resolve_path("/f9")
+    fs.add_file("/f9", b"changed", compress=False)
+    assert fs._swap_files([("/f9", stale, stale)]) == [False]
+
+    job.start().wait(timeout=10)
+    assert job.done and job.files_compressed == 9
+    assert fs.read_file("/f9") == b"changed"
+
+def test_recompression_throttle_ignores_earlier_runs():
+    fs = DistributedFileSystem()
+    for i in range(8):
+        fs.add_file(f"/f{i}", b"abcdefgh" * 1000, compress=False)
+
+    job = RecompressionJob(fs, page_size=4, bytes_per_second=10_000_000)
+    job.step()
+    job.bytes_read += 10 ** 9  # as if GBs were read before a pause
+    start = time.monotonic()
+    assert job.start().wait(timeout=5)
+    assert time.monotonic() - start < 2 and job.files_compressed == 8
+
+def test_close_stops_recompression_before_the_journal(tmp_path):
+    storage = DiskStorage(base_path=str(tmp_path / "storage"))
+    fs1 = DistributedFileSystem(storage_backend=storage)
+    for i in range(20):
+        fs1.add_file(f"/f{i}", b"abcdefgh" * 1000, compress=False)
+    job = fs1.enable_compression(bytes_per_second=50_000)  # slow enough to still be running
+    fs1.close()
+    assert not job.running and not job.done
+
+    fs2 = DistributedFileSystem(storage_backend=storage)
+    assert all(fs2.read_file(f"/f{i}") == b"abcdefgh" * 1000 for i in range(20))
+    fs2.close()
+
+def test_small_files_are_inlined(fs):
+    fs.add_file("/config.yaml", b"Hello, world!")
+    meta = fs._resolve_path("/config.yaml")
+    assert meta.inline == b"Hello, world!" and meta.content_hash == ""
+    assert fs.storage.store == {}
+    assert fs.read_file("/config.yaml") == b"Hello, world!"
+    assert fs.read_range("/config.yaml", 7, 5) == b"world"
+    assert fs.read_files(["/config.yaml"]) == {"/config.yaml": b"Hello, world!"}
+
+    with fs.open_write("/streamed.cfg") as out:
+        out.write(b"key=value")
+    assert fs._resolve_path("/streamed.cfg").inline == b"key=value"
+
+    fs.add_file("/config.yaml", b"x" * 600)  # grows past the threshold
+    assert fs._resolve_path("/config.yaml").inline is None
+    fs.add_file("/config.yaml", b"small again")
+    assert fs.storage.store == {}  # the blob was released
+    assert fs.get_stats()['bytes_inline'] == len(b"Hello, world!key=valuesmall again")
+
+def test_inline_threshold_zero_disables_inlining():
+    fs = DistributedFileSystem(inline_threshold=0)
+    fs.add_file("/f", b"tiny")
+    assert fs._resolve_path("/f").inline is None
+    assert list(fs.storage.store.values()) == [b"tiny"]
+
+def test_metadata_nodes_are_compact():
+    fs = DistributedFileSystem(inline_threshold=0)
+    fs.mkdir("/a")
+    fs.mkdir("/b")
+    fs.add_file("/a/part-0", b"payload")
+    fs.add_file("/b/part-0", b"payload")
+
+    meta = fs._resolve_path("/a/part-0")
+    assert not hasattr(meta, "__dict__") and not hasattr(fs.root, "__dict__")
+    assert len(meta.digest) == 32
+    assert fs.storage.read(meta.content_hash) == b"payload"
+
+    names = [next(iter(fs._resolve_path(d).children)) for d in ("/a", "/b")]
+    assert names[0] is names[1]  # interned
+
 def test_compression_disabling(fs):
     content = b"Hello" * 1000  # Large enough to trigger compression
     fs.add_file("/compressed.txt", content, compress=True)
@@ -153,4 +802,287 @@ def test_cache_efficiency(fs):
     # Second access should hit cache
     fs._resolve_path("/cache_test")
     stats = fs.get_stats()
-    assert stats['cache_hits'] > 0
\ No newline at end of file
+    assert stats['cache_hits'] > 0
+
+def test_cache_invalidation_is_subtree_only(fs):
+    for path in ("/data", "/data/sub", "/data2"):
+        fs.mkdir(path)
+        fs._resolve_path(path)
+
+    fs._invalidate_cache("/data")
+    assert "/data" not in fs.path_cache
+    assert "/data/sub" not in fs.path_cache
+    assert "/data2" in fs.path_cache
+
+def test_path_cache_lru_eviction():
+    cache = PathCache(max_size=2)
+    cache.put("/a", "A")
+    cache.put("/b", "B")
+    cache.get("/a")
+    cache.put("/c", "C")
+
+    assert len(cache) == 2
+    assert "/b" not in cache
+    assert cache.get("/a") == "A" and cache.get("/c") == "C"
+    assert "b" not in cache.trie.children
+
+def test_operation_metrics(fs):
+    fs.mkdir("/m")
+    for i in range(50):
+        fs.add_file(f"/m/f{i}", b"metrics " * 500)
+    for i in range(50):
+        fs.read_file(f"/m/f{i}")
+    fs.list_dir("/m")
+
+    stats = fs.get_stats()
+    assert stats['op_counts'] == {'mkdir': 1, 'add_file': 50, 'read_file': 50, 'list_dir': 1}
+    assert stats['operations'] == 102
+    for op in ('mkdir', 'add_file', 'read_file', 'list_dir'):
+        assert 0 < stats['latency'][op]['p50'] <= stats['latency'][op]['p99']
+    assert stats['cache_hits'] > 0 and stats['cache_misses'] > 0
+    assert 0 < stats['cache_hit_ratio'] < 1
+    assert stats['bytes_before_compression'] == 50 * len(b"metrics " * 500)
+    assert 0 < stats['compression_ratio'] < 0.1
+    assert stats['lock_wait_seconds'] == 0
+
+def test_metrics_merge_thread_shards():
+    from concurrent.futures import ThreadPoolExecutor
+    from filesystem import Metrics
+
+    metrics = Metrics()
+
+    def work(_):
+        for _ in range(1000):
+            metrics.incr('events')
+            metrics.observe('op', 1e-6)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(work, range(8)))
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['events'] == 8000
+    assert snapshot['latency']['op']['count'] == 8000
+    assert 1e-6 <= snapshot['latency']['op']['p99'] < 1.2e-6
+
+def test_metrics_retire_dead_thread_shards(fs):
+    from filesystem import Metrics
+
+    metrics = Metrics()
+    for _ in range(50):
+        thread = threading.Thread(target=metrics.incr, args=('events',))
+        thread.start()
+        thread.join()
+    assert len(metrics._shards) == 0  # every shard folded into the retired total
+    assert metrics.snapshot()['counters']['events'] == 50
+
+    fs.add_file("/r", b"range " * 100)
+    fs.read_range("/r", 6, 5)
+    assert fs.get_stats()['op_counts'] == {'add_file': 1, 'read_range': 1}
+
+# ======================
+# Consistent Hashing Tests
+# ======================
+
+def test_ring_lookup_matches_linear_scan():
+    hasher = ConsistentHasher([f"node-{i}" for i in range(16)])
+    ring_keys = sorted(hasher.ring)
+
+    for i in range(500):
+        key = f"/data/file_{i}.txt"
+        hash_key = ConsistentHasher._hash(key)
+        expected = next((hasher.ring[h] for h in ring_keys if hash_key <= h), hasher.ring[ring_keys[0]])
+        assert hasher.get_node(key) == expected
+
+def test_ring_add_remove_node():
+    hasher = ConsistentHasher(["a", "b"])
+    keys = [f"/k{i}" for i in range(1000)]
+    before = hasher.get_nodes_bulk(keys)
+
+    hasher.add_node("c")
+    assert len(hasher.sorted_hashes) == 3 * hasher.virtual_nodes
+    assert hasher.sorted_hashes == sorted(hasher.ring)
+
+    hasher.remove_node("c")
+    assert hasher.nodes == ["a", "b"]
+    assert hasher.get_nodes_bulk(keys) == before
+    assert [hasher.get_node(k) for k in keys] == before
+
+# ======================
+# Cluster Tests
+# ======================
+
+@pytest.fixture
+def peers():
+    """Two in-process nodes serving each other over loopback"""
+    a, b = DistributedFileSystem(), DistributedFileSystem()
+    a_address, b_address = a.serve(), b.serve()
+    a.add_peer(b_address)
+    b.add_peer(a_address)
+    yield a, b
+    a.close()
+    b.close()
+
+def test_operations_route_to_owning_node(peers):
+    a, b = peers
+    a.mkdir("/data")
+    files = {f"/data/f{i}": f"content {i}".encode() * 100 for i in range(100)}
+    a.add_files(files)
+
+    local_a, local_b = a._list_page("/data", None, None), b._list_page("/data", None, None)
+    assert local_a and local_b and not set(local_a) & set(local_b)  # each file lives on one node
+    assert b.read_files(list(files)) == files
+    assert a.list_dir("/data") == b.list_dir("/data") == sorted(path.split("/")[-1] for path in files)
+    assert a.list_dir("/data", start_after="f50", limit=3) == ["f51", "f52", "f53"]
+
+    path = next(p for p in files if a._owner(p) is not None)
+    b.add_file(path, b"replaced" * 200)
+    assert a.read_file(path) == b"replaced" * 200
+    assert a.read_range(path, 8, 8) == b"replaced"
+    with pytest.raises(ValueError, match="Path is not a file"):
+        a.read_file("/data/missing")
+
+def test_rpc_requires_shared_secret():
+    server = DistributedFileSystem(cluster_secret=b"s3cret")
+    address = server.serve()
+    server.mkdir("/data")
+
+    good = RemoteNode(address, secret=b"s3cret")
+    assert good.call("list_dirs") == ["/data"]
+    bad = RemoteNode(address, secret=b"guess")
+    with pytest.raises(ConnectionError):
+        bad.call("list_dirs")
+    with pytest.raises(ValueError, match="secret"):
+        DistributedFileSystem().serve(host="0.0.0.0")
+    good.close()
+    bad.close()
+    server.close()
+
+def test_rpc_timeout_keeps_connection_usable():
+    import marshal
+    import socket
+    import struct
+    from filesystem import RPC_FRAME, RPC_NONCE
+
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def slow_server():
+        sock, _ = listener.accept()
+        sock.sendall(b"\0" * RPC_NONCE)
+        sock.recv(64)  # proof; this fake server trusts anyone
+        for delay in (0.5, 0):
+            request_id, length = RPC_FRAME.unpack(sock.recv(RPC_FRAME.size, socket.MSG_WAITALL))
+            sock.recv(length, socket.MSG_WAITALL)
+            time.sleep(delay)
+            reply = marshal.dumps([(True, request_id)])
+            sock.sendall(RPC_FRAME.pack(request_id, len(reply)) + reply)
+        sock.recv(1)
+        sock.close()
+
+    threading.Thread(target=slow_server, daemon=True).start()
+    node = RemoteNode(f"127.0.0.1:{listener.getsockname()[1]}", pool_size=1, timeout=0.2)
+    with pytest.raises(TimeoutError):
+        node.call("list_dirs")
+    node.timeout = 5
+    assert node.call("list_dirs") == 1  # the late reply to request 0 was dropped, not fatal
+    node.close()
+    listener.close()
+
+def test_rpc_replies_cancel_their_deadlines(peers):
+    from filesystem import _DEADLINES
+    a, b = peers
+    node = a.peers[b.current_node]
+    for future in [node.call_async("list_dirs") for _ in range(2000)]:
+        future.result()
+    with _DEADLINES.cond:
+        live = [entry for entry in _DEADLINES.heap if entry[2] is not None]
+        assert len(_DEADLINES.heap) < 200 and not live
+
+def test_client_reaches_new_owner_after_add_node(peers):
+    a, b = peers
+    client = DistributedFileSystem(journal=False)
+    client.consistent_hasher.remove_node(client.current_node)  # owns no keys, like cluster.client()
+    for node in (a, b):
+        client.add_peer(node.current_node)
+    client.mkdir("/data")
+    files = {f"/data/f{i}": f"payload {i}".encode() * 50 for i in range(200)}
+    client.add_files(files)
+
+    c = DistributedFileSystem()
+    c_address = c.serve()
+    try:
+        assert a.add_node(c_address)["files_moved"] > 0
+        assert c_address not in client.peers  # the client's ring is now stale
+        assert all(client.read_file(path) == content for path, content in files.items())
+        assert client.read_files(list(files)) == files
+        assert len(client.list_dir("/data")) == 200
+
+        client.mkdir("/later")
+        client.add_files({f"/later/g{i}": b"after the join" for i in range(50)})
+        client.add_file("/later/single", b"routed by a stale ring")
+        owned = [f"/later/g{i}" for i in range(50) if c._locate_shard(f"/later/g{i}") == c_address]
+        assert owned and set(c._list_page("/later", None, None)) >= {p.split("/")[-1] for p in owned}
+        assert len(client.list_dir("/later")) == 51
+    finally:
+        client.close()
+        c.close()
+
+def test_local_cluster_processes():
+    files = {f"/data/f{i}": os.urandom(2000) for i in range(60)}
+    with LocalCluster(3) as cluster:
+        client = cluster.client()
+        client.mkdir("/data")
+        client.add_files(files)
+        assert client.read_files(list(files)) == files
+        assert len(client.list_dir("/data")) == 60
+        counts = [len(client.peers[address].call("list_page", "/data", None, None))
+                  for address in cluster.addresses]
+        assert sum(counts) == 60 and all(counts)
+        client.close()
+
+def test_ring_change_moves_only_new_owner_share():
+    ring = ConsistentHasher([f"node-{i}" for i in range(4)])
+    grown = ring.copy()
+    grown.add_node("node-4")
+    keys = [f"/data/f{i}" for i in range(20000)]
+
+    moves = [(old, new) for old, new in zip(ring.get_nodes_bulk(keys), grown.get_nodes_bulk(keys)) if old != new]
+    assert {new for _, new in moves} == {"node-4"}  # nothing shuffles between old nodes
+    assert 0.15 < len(moves) / len(keys) < 0.25     # about 1/N with N = 5
+
+    arcs = grown.moved_ranges(ring)
+    assert all(new == "node-4" for _, _, _, new in arcs)
+    share = sum((end - start) % 2 ** 160 for start, end, _, _ in arcs) / 2 ** 160
+    assert abs(share - len(moves) / len(keys)) < 0.02
+
+def test_add_and_remove_node_rebalances_files(peers):
+    a, b = peers
+    a.mkdir("/data")
+    files = {f"/data/f{i}": f"payload {i}".encode() * 200 for i in range(300)}
+    a.add_files(files)
+
+    c = DistributedFileSystem()
+    c_address = c.serve()
+    try:
+        # Mid-move: rings switched, nothing streamed yet; reads still succeed
+        members = list(a.consistent_hasher.nodes)
+        c._ring_join(members)
+        for node in (a, b):
+            node._ring_change("add", c_address)
+        assert c._list_page("/data", None, None) == []
+        assert a.read_files(list(files)) == files
+
+        moved = sum(node._rebalance()["files_moved"] for node in (a, b))
+        for node in (a, b, c):
+            node._ring_settle()
+        on_c = c._list_page("/data", None, None)
+        assert len(on_c) == moved and 0.2 < moved / len(files) < 0.45
+        assert all(c._locate_shard(f"/data/{name}") == c_address for name in on_c)
+        assert c.read_files(list(files)) == files
+
+        a.remove_node(c_address)
+        assert c._list_page("/data", None, None) == []
+        assert c_address not in a.consistent_hasher.nodes and c_address not in b.peers
+        assert b.read_files(list(files)) == files
+        assert len(a._list_page("/data", None, None)) + len(b._list_page("/data", None, None)) == len(files)
+    finally:
+        c.close()
@@ -0,0 +1,156 @@
+"""
+Micro-benchmarks for data_store.py
+
+    python bench_data_store.py            # run every benchmark
+    python bench_data_store.py logging    # run selected benchmarks by name
+"""
+
+import heapq
+import io
+import logging
+import random
+import sys
+import time
+
+from data_store import CountingStore, logger
+
+# ======================
+# Hot-Path Logging
+# ======================
+
+def _ns_per_op(op, ops):
+    start = time.perf_counter()
+    for i in range(ops):
+        op(i)
+    return (time.perf_counter() - start) / ops * 1e9
+
+def bench_logging(ops=200_000, keys=1000):
+    """Per-op cost of WRITE/READ/COUNTVAL with tracing off vs on, next to a bare dict write"""
+    names = [f"k{i}" for i in range(keys)]
+    plain = {}
+
+    def dict_write(i):
+        plain[names[i % keys]] = i
+
+    print(f"{'mode':>10} {'dict ns':>8} {'write ns':>9} {'read ns':>8} {'countval ns':>12}")
+    handler = logging.NullHandler()  # pay for formatting and dispatch, not terminal I/O
+    logger.addHandler(handler)
+    previous = logger.level
+    try:
+        for mode, level in (('off', logging.WARNING), ('debug', logging.DEBUG)):
+            logger.setLevel(level)
+            store = CountingStore()
+            costs = [_ns_per_op(dict_write, ops),
+                     _ns_per_op(lambda i: store.write(names[i % keys], i), ops),
+                     _ns_per_op(lambda i: store.read(names[i % keys]), ops),
+                     _ns_per_op(lambda i: store.countval(i), ops)]
+            print(f"{mode:>10} " + " ".join(f"{cost:>{width}.0f}" for cost, width in zip(costs, (8, 9, 8, 12))))
+    finally:
+        logger.setLevel(previous)
+        logger.removeHandler(handler)
+
+# ======================
+# Command Replay
+# ======================
+
+def bench_replay(lines=500_000, keys=10_000):
+    """Replay a command file line by line with per-line prints vs run_batch()"""
+    rng = random.Random(0)
+    script = []
+    for _ in range(lines):
+        roll = rng.random()
+        if roll < 0.6:
+            script.append(f"WRITE k{rng.randrange(keys)} {rng.randrange(100)}")
+        elif roll < 0.9:
+            script.append(f"READ k{rng.randrange(keys)}")
+        else:
+            script.append(f"COUNTVAL {rng.randrange(100)}")
+    text = "\n".join(script) + "\n"
+
+    def line_by_line(out):
+        store = CountingStore()
+        for line in io.StringIO(text):
+            result = store.process_command(line)
+            if result:
+                print(result, file=out)
+
+    def batched(out):
+        CountingStore().run_batch(io.StringIO(text), out)
+
+    print(f"{'method':>12} {'lines/s':>12}")
+    outputs = []
+    for label, run in (('per-line', line_by_line), ('run_batch', batched)):
+        out = io.StringIO()
+        start = time.perf_counter()
+        run(out)
+        print(f"{label:>12} {lines / (time.perf_counter() - start):>12,.0f}")
+        outputs.append(out.getvalue())
+    assert outputs[0] == outputs[1]
+
+# ======================
+# Checkpoints
+# ======================
+
+def bench_revert(writes=1_000_000, keys=1000):
+    """Writes inside one checkpoint, then the checkpoint's undo size and REVERT time"""
+    store = CountingStore()
+    store.checkpoint()
+    names = [f"k{i}" for i in range(keys)]
+    for i in range(writes):
+        store.write(names[i % keys], i)
+    undo = len(store.checkpoints[-1])
+    start = time.perf_counter()
+    store.revert()
+    print(f"{writes:,} writes over {keys:,} keys: {undo:,} undo entries, "
+          f"revert {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+# ======================
+# Value Distribution
+# ======================
+
+def bench_value_queries(keys=200_000, values=50_000, queries=20):
+    """COUNTRANGE/TOPVALUES through the index vs scanning store, plus WRITE cost"""
+    rng = random.Random(0)
+    store = CountingStore()
+    start = time.perf_counter()
+    for i in range(keys):
+        store.write(f"k{i}", rng.randrange(values))
+    print(f"write {(time.perf_counter() - start) / keys * 1e9:.0f} ns/op")
+    ranges = [sorted(rng.randrange(values) for _ in range(2)) for _ in range(queries)]
+
+    def scan_range(lo, hi):
+        return sum(1 for value in store.store.values() if lo <= value <= hi)
+
+    def scan_top(k):
+        counts = {}
+        for value in store.store.values():
+            counts[value] = counts.get(value, 0) + 1
+        return heapq.nsmallest(k, counts.items(), key=lambda item: (-item[1], item[0]))
+
+    start = time.perf_counter()
+    store.countrange(0, 0)  # the first query folds the whole load into the index
+    print(f"first query {(time.perf_counter() - start) * 1e3:.0f} ms")
+    print(f"{'query':>12} {'scan us':>10} {'index us':>10}")
+    for label, scan, indexed, args in (
+            ('COUNTRANGE', scan_range, store.countrange, ranges),
+            ('TOPVALUES', scan_top, store.topvalues, [(10,)] * queries)):
+        costs = []
+        for query in (scan, indexed):
+            start = time.perf_counter()
+            answers = [query(*arg) for arg in args]
+            costs.append((time.perf_counter() - start) / len(args) * 1e6)
+        assert answers == [scan(*arg) for arg in args]
+        print(f"{label:>12} {costs[0]:>10.1f} {costs[1]:>10.1f}")
+
+BENCHMARKS = {
+    'logging': bench_logging,
+    'replay': bench_replay,
+    'revert': bench_revert,
+    'value_queries': bench_value_queries,
+}
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
@@ -1,134 +1,542 @@
+import bisect
+import heapq
 import json
 import os
 import logging
+import struct
 import sys
+import threading
+import zlib
 from collections import defaultdict
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler()]
-)
 logger = logging.getLogger(__name__)
 
 
+class WriteAheadLog:
+    """Append-only binary log of WRITE/CHECKPOINT/REVERT plus background snapshots.
+
+    The directory holds numbered generations (wal-000001.log, ...) and
+    snapshot.json, which already includes every generation up to its
+    "generation" field. Each record reaches the OS as it is appended, so it
+    survives the process dying; a flusher thread fsyncs pending records as a
+    group every sync_interval seconds, and an append fsyncs as soon as
+    sync_every records are pending, so a machine crash loses at most that
+    last unsynced group. Once the active generation reaches compact_every records
+    it is closed and a background thread folds it into a new snapshot, so
+    neither writes nor recovery ever touch more than the log tail.
+    """
+    CRC = struct.Struct('<I')
+    HEADER = struct.Struct('<BHq')  # op, name length, value
+    WRITE, CHECKPOINT, REVERT = 1, 2, 3
+    SNAPSHOT = "snapshot.json"
+
+    def __init__(self, directory: str, sync_every: int = 1024, sync_interval: float = 0.05,
+                 compact_every: int = 1_000_000):
+        self.directory = directory
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.generation = 0
+        self.records = 0
+        # written only moves on the appending thread, synced only under lock
+        self.written = 0
+        self.synced = 0
+        self.lock = threading.Lock()
+        self.file = None
+        self.compactor = None
+        self.closing = threading.Event()
+        self.flusher = None
+        os.makedirs(directory, exist_ok=True)
+
+    def recover(self, store):
+        """Load the snapshot into store, replay the log tail, then open a fresh generation"""
+        covered = self._load_snapshot(store)
+        replayed = 0
+        for generation in self._generations():
+            if generation > covered:
+                replayed += self._replay(generation, store)
+        self.generation = max(self._generations(), default=covered) + 1
+        self.file = open(self._log_path(self.generation), "ab", buffering=0)
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+        logger.info("WAL: Recovered from '%s', replayed %d records", self.directory, replayed)
+
+    def append(self, op: int, name: str = "", value: int = 0):
+        encoded = name.encode()
+        body = self.HEADER.pack(op, len(encoded), value) + encoded
+        self.file.write(self.CRC.pack(zlib.crc32(body)) + body)
+        self.records += 1
+        self.written += 1
+        if self.written - self.synced >= self.sync_every:
+            self.sync()
+        if self.records >= self.compact_every and not self.compacting():
+            self._rotate()
+            self.compactor = threading.Thread(target=self._compact, args=(self.generation - 1,), daemon=True)
+            self.compactor.start()
+
+    def sync(self):
+        """Group commit: one fsync makes every pending record durable"""
+        with self.lock:
+            written = self.written
+            if written != self.synced and self.file is not None:
+                os.fsync(self.file.fileno())
+                self.synced = written
+
+    def _flush_loop(self):
+        while not self.closing.wait(self.sync_interval):
+            self.sync()
+
+    def compacting(self) -> bool:
+        return self.compactor is not None and self.compactor.is_alive()
+
+    def snapshot(self, store):
+        """Replace snapshot and log with store's current state (used after LOAD)"""
+        if self.compactor is not None:
+            self.compactor.join()
+        self._rotate()
+        self._write_snapshot(store, self.generation - 1)
+        self._drop_generations(self.generation - 1)
+
+    def close(self):
+        self.closing.set()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+        if self.compactor is not None:
+            self.compactor.join()
+
+    def _rotate(self):
+        self.sync()
+        with self.lock:
+            self.file.close()
+            self.generation += 1
+            self.records = 0
+            self.file = open(self._log_path(self.generation), "ab", buffering=0)
+
+    def _compact(self, upto: int):
+        """Fold closed generations into a new snapshot, off the write path"""
+        store = CountingStore()
+        covered = self._load_snapshot(store)
+        for generation in self._generations():
+            if covered < generation <= upto:
+                self._replay(generation, store)
+        self._write_snapshot(store, upto)
+        self._drop_generations(upto)
+        logger.info("WAL: Compacted generations up to %d", upto)
+
+    def _replay(self, generation: int, store) -> int:
+        path = self._log_path(generation)
+        with open(path, "rb") as f:
+            data = f.read()
+        offset, count = 0, 0
+        prefix = self.CRC.size + self.HEADER.size
+        while offset + prefix <= len(data):
+            (crc,) = self.CRC.unpack_from(data, offset)
+            op, length, value = self.HEADER.unpack_from(data, offset + self.CRC.size)
+            end = offset + prefix + length
+            if end > len(data) or zlib.crc32(data[offset + self.CRC.size:end]) != crc:
+                break
+            if op == self.WRITE:
+                store.write(data[offset + prefix:end].decode(), value)
+            elif op == self.CHECKPOINT:
+                store.checkpoint()
+            else:
+                store.revert()
+            offset = end
+            count += 1
+        if offset < len(data):
+            logger.warning("WAL: Dropping torn tail of '%s' at byte %d", path, offset)
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        return count
+
+    def _load_snapshot(self, store) -> int:
+        path = os.path.join(self.directory, self.SNAPSHOT)
+        if not os.path.exists(path):
+            return 0
+        with open(path, "r") as f:
+            data = json.load(f)
+        store._restore(data)
+        return data["generation"]
+
+    def _write_snapshot(self, store, generation: int):
+        path = os.path.join(self.directory, self.SNAPSHOT)
+        with open(path + ".tmp", "w") as f:
+            json.dump(dict(store._state(), generation=generation), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _drop_generations(self, upto: int):
+        for generation in self._generations():
+            if generation <= upto:
+                os.remove(self._log_path(generation))
+
+    def _generations(self):
+        return sorted(int(name[4:-4]) for name in os.listdir(self.directory)
+                      if name.startswith("wal-") and name.endswith(".log"))
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"wal-{generation:06d}.log")
+
+
+class ValueIndex:
+    """Order statistics over a value -> count map, for COUNTRANGE and TOPVALUES.
+
+    Writers only add changed values to `touched`; queries fold those in first.
+    Range counts come from levels of Fenwick trees, each over a sorted run of
+    values: new values arrive as one sorted level, which absorbs every level
+    up to twice its size, so sizes more than double from level to level.
+    That keeps O(log n) levels and each value is re-merged O(log n) times,
+    so COUNTRANGE costs O(log^2 n). TOPVALUES pops a heap of (-count, value)
+    entries, skipping those the live counts no longer match.
+    """
+
+    def __init__(self, value_count):
+        self.value_count = value_count
+        self.touched = set(value_count)
+        self.counts = {}       # value -> non-zero count as last folded in
+        self.levels = []       # (sorted values, Fenwick tree), largest first
+        self.position = {}     # value -> (tree, 1-based index)
+        self.heap = []         # (-count, value), possibly stale
+
+    def count_range(self, lo, hi) -> int:
+        self._refresh()
+        total = 0
+        if lo <= hi:
+            for values, tree in self.levels:
+                total += (self._prefix(tree, bisect.bisect_right(values, hi))
+                          - self._prefix(tree, bisect.bisect_left(values, lo)))
+        return total
+
+    def top(self, k: int) -> list:
+        """The k most common values as (value, count), ties broken by smaller value"""
+        self._refresh()
+        heap, counts = self.heap, self.counts
+        result, taken = [], set()
+        while heap and len(result) < k:
+            negated, value = heapq.heappop(heap)
+            if counts.get(value) == -negated and value not in taken:
+                taken.add(value)
+                result.append((value, -negated))
+        for value, count in result:
+            heapq.heappush(heap, (-count, value))
+        return result
+
+    def _refresh(self):
+        if not self.touched:
+            return
+        counts, entries, fresh = self.counts, [], []
+        for value in self.touched:
+            count = self.value_count.get(value, 0)
+            old = counts.get(value, 0)
+            if count == old:
+                continue
+            if count:
+                counts[value] = count
+                entries.append((-count, value))
+            else:
+                del counts[value]
+            slot = self.position.get(value)
+            if slot is not None:
+                self._add(slot[0], slot[1], count - old)
+            else:
+                fresh.append(value)
+        self.touched.clear()
+        if fresh:
+            self._add_level(sorted(fresh))
+        heap = self.heap
+        if len(entries) > len(heap) or len(heap) > 2 * len(counts) + 64:
+            # A bulk change, or mostly stale entries: rebuilding is linear
+            self.heap = [(-count, value) for value, count in counts.items()]
+            heapq.heapify(self.heap)
+        else:
+            for entry in entries:
+                heapq.heappush(heap, entry)
+
+    def _add_level(self, values):
+        merged = values
+        while self.levels and len(self.levels[-1][0]) <= 2 * len(merged):
+            # Two sorted runs: timsort merges them in linear time
+            merged = sorted(self.levels.pop()[0] + merged)
+        position, counts = self.position, self.counts
+        values = [value for value in merged if value in counts]
+        if len(values) != len(merged):
+            for value in merged:
+                if value not in counts:
+                    position.pop(value, None)  # count fell to zero; re-enters as fresh
+        tree = [0] + [counts[value] for value in values]
+        size = len(tree)
+        for index in range(1, size):
+            parent = index + (index & -index)
+            if parent < size:
+                tree[parent] += tree[index]
+        position.update(zip(values, [(tree, index) for index in range(1, size)]))
+        self.levels.append((values, tree))
+
+    @staticmethod
+    def _add(tree, index, delta):
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    @staticmethod
+    def _prefix(tree, index) -> int:
+        total = 0
+        while index:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+
 class CountingStore:
-    def __init__(self):
+    def __init__(self, wal_dir: str = None, **wal_options):
         self.store = {}
         self.value_count = defaultdict(int)
+        self.value_index = ValueIndex(self.value_count)
+        # One delta per checkpoint: key -> value before it (None if unset), so
+        # checkpoint is O(1) and revert touches each changed key once
         self.checkpoints = []
+        self.wal = None
+        # Per-op tracing is decided once here so the hot path pays a single
+        # attribute test; flip it directly to trace a live store
+        self.trace = logger.isEnabledFor(logging.DEBUG)
+        if wal_dir is not None:
+            wal = WriteAheadLog(wal_dir, **wal_options)
+            wal.recover(self)
+            self.wal = wal
         logger.debug("Initialized CountingStore")
 
     def write(self, name: str, value):
+        if self.wal is not None:
+            self.wal.append(WriteAheadLog.WRITE, name, value)
         old_value = self.store.get(name)
+        touched = self.value_index.touched
         if old_value is not None:
             self.value_count[old_value] -= 1
+            touched.add(old_value)
         self.store[name] = value
         self.value_count[value] += 1
+        touched.add(value)
 
         if self.checkpoints:
-            self.checkpoints[-1].append(('WRITE', name, old_value))
+            # Only the value from before the checkpoint matters to a revert
+            delta = self.checkpoints[-1]
+            if name not in delta:
+                delta[name] = old_value
 
-        logger.debug(f"WRITE: {name} = {value} (old: {old_value})")
+        if self.trace:
+            logger.debug("WRITE: %s = %s (old: %s)", name, value, old_value)
 
     def read(self, name: str) -> str:
         value = self.store.get(name)
-        logger.debug(f"READ: {name} => {value if value is not None else 'No value'}")
+        if self.trace:
+            logger.debug("READ: %s => %s", name, value if value is not None else 'No value')
         return str(value) if value is not None else "No value"
 
     def countval(self, value) -> int:
         count = self.value_count.get(value, 0)
-        logger.debug(f"COUNTVAL: {value} => {count}")
+        if self.trace:
+            logger.debug("COUNTVAL: %s => %s", value, count)
+        return count
+
+    def countrange(self, lo, hi) -> int:
+        count = self.value_index.count_range(lo, hi)
+        if self.trace:
+            logger.debug("COUNTRANGE: %s..%s => %s", lo, hi, count)
         return count
 
+    def topvalues(self, k: int) -> list:
+        top = self.value_index.top(k)
+        if self.trace:
+            logger.debug("TOPVALUES: %s => %s", k, top)
+        return top
+
     def checkpoint(self):
-        self.checkpoints.append([])
-        logger.debug(f"CHECKPOINT created. Total: {len(self.checkpoints)}")
+        if self.wal is not None:
+            self.wal.append(WriteAheadLog.CHECKPOINT)
+        self.checkpoints.append({})
+        if self.trace:
+            logger.debug("CHECKPOINT created. Total: %d", len(self.checkpoints))
 
     def revert(self) -> str:
         if not self.checkpoints:
-            logger.debug("REVERT: Nothing to revert")
+            if self.trace:
+                logger.debug("REVERT: Nothing to revert")
             return "Nothing to revert"
+        if self.wal is not None:
+            self.wal.append(WriteAheadLog.REVERT)
         changes = self.checkpoints.pop()
-        for action in reversed(changes):
-            _, name, old_value = action
+        touched = self.value_index.touched
+        for name, old_value in changes.items():
             new_value = self.store.get(name)
             if new_value is not None:
                 self.value_count[new_value] -= 1
+                touched.add(new_value)
             if old_value is None:
                 if name in self.store:
                     del self.store[name]
             else:
                 self.store[name] = old_value
                 self.value_count[old_value] += 1
-        logger.debug(f"REVERT: Applied {len(changes)} changes. Checkpoints left: {len(self.checkpoints)}")
+                touched.add(old_value)
+        if self.trace:
+            logger.debug("REVERT: Applied %d changes. Checkpoints left: %d", len(changes), len(self.checkpoints))
         return ""
 
-    def save(self, filename: str):
-        data = {
+    def _state(self) -> dict:
+        return {
             "store": self.store,
             "value_count": dict(self.value_count),
             "checkpoints": self.checkpoints,
         }
+
+    def _restore(self, data: dict):
+        self.store = data["store"]
+        # JSON turns the integer keys of value_count into strings, so count afresh
+        self.value_count = defaultdict(int)
+        for value in self.store.values():
+            self.value_count[value] += 1
+        self.value_index = ValueIndex(self.value_count)
+        # Older saves hold undo lists of ('WRITE', name, old); the earliest entry per key wins
+        self.checkpoints = [
+            checkpoint if isinstance(checkpoint, dict)
+            else {name: old for _, name, old in reversed(checkpoint)}
+            for checkpoint in data["checkpoints"]
+        ]
+
+    def save(self, filename: str):
         with open(filename, "w") as f:
-            json.dump(data, f)
-        logger.info(f"SAVE: State saved to '{filename}'")
+            json.dump(self._state(), f)
+        logger.info("SAVE: State saved to '%s'", filename)
 
     def load(self, filename: str):
         if not os.path.exists(filename):
-            logger.error(f"LOAD: File not found - '{filename}'")
+            logger.error("LOAD: File not found - '%s'", filename)
             return "Error: File not found"
         with open(filename, "r") as f:
-            data = json.load(f)
-            self.store = data["store"]
-            self.value_count = defaultdict(int, data["value_count"])
-            self.checkpoints = data["checkpoints"]
-        logger.info(f"LOAD: State loaded from '{filename}'")
+            self._restore(json.load(f))
+        if self.wal is not None:
+            self.wal.snapshot(self)
+        logger.info("LOAD: State loaded from '%s'", filename)
+
+    def close(self):
+        if self.wal is not None:
+            self.wal.close()
+
+    # Command handlers take the argument tokens and return the output line, if any
+
+    def _cmd_write(self, args):
+        self.write(args[0], int(args[1]))
+
+    def _cmd_read(self, args):
+        return self.read(args[0])
+
+    def _cmd_countval(self, args):
+        return str(self.countval(int(args[0])))
+
+    def _cmd_countrange(self, args):
+        return str(self.countrange(int(args[0]), int(args[1])))
+
+    def _cmd_topvalues(self, args):
+        top = self.topvalues(int(args[0]))
+        return " ".join(f"{value}:{count}" for value, count in top) if top else "No values"
+
+    def _cmd_checkpoint(self, args):
+        self.checkpoint()
+
+    def _cmd_revert(self, args):
+        return self.revert()
+
+    def _cmd_save(self, args):
+        if not args and self.wal is not None:
+            # Durable mode: the log already holds everything, just commit it
+            self.wal.sync()
+            return
+        if len(args) != 1:
+            return "Error: SAVE requires a filename"
+        self.save(args[0])
+
+    def _cmd_load(self, args):
+        if len(args) != 1:
+            return "Error: LOAD requires a filename"
+        return self.load(args[0])
+
+    COMMANDS = {
+        "WRITE": _cmd_write,
+        "READ": _cmd_read,
+        "COUNTVAL": _cmd_countval,
+        "COUNTRANGE": _cmd_countrange,
+        "TOPVALUES": _cmd_topvalues,
+        "CHECKPOINT": _cmd_checkpoint,
+        "REVERT": _cmd_revert,
+        "SAVE": _cmd_save,
+        "LOAD": _cmd_load,
+    }
+
+    def execute(self, lines) -> list:
+        """Run command lines in order and return their non-empty outputs"""
+        commands = self.COMMANDS
+        outputs = []
+        for line in lines:
+            tokens = line.split()
+            if not tokens:
+                continue
+            handler = commands.get(tokens[0]) or commands.get(tokens[0].upper())
+            if handler is None:
+                outputs.append("Invalid command")
+                continue
+            try:
+                result = handler(self, tokens[1:])
+            except Exception as e:
+                logger.exception("Error processing command")
+                result = f"Error: {str(e)}"
+            if result:
+                outputs.append(result)
+        return outputs
 
     def process_command(self, line: str) -> str:
-        tokens = line.strip().split()
-        if not tokens:
-            return ""
-        cmd = tokens[0].upper()
-        args = tokens[1:]
-
-        try:
-            if cmd == "WRITE":
-                self.write(args[0], int(args[1]))
-                return ""
-            elif cmd == "READ":
-                return self.read(args[0])
-            elif cmd == "COUNTVAL":
-                return str(self.countval(int(args[0])))
-            elif cmd == "CHECKPOINT":
-                self.checkpoint()
-                return ""
-            elif cmd == "REVERT":
-                msg = self.revert()
-                return msg if msg else ""
-            elif cmd == "SAVE":
-                if len(args) != 1:
-                    return "Error: SAVE requires a filename"
-                self.save(args[0])
-                return ""
-            elif cmd == "LOAD":
-                if len(args) != 1:
-                    return "Error: LOAD requires a filename"
-                msg = self.load(args[0])
-                return msg if msg else ""
-            else:
-                return "Invalid command"
-        except Exception as e:
-            logger.exception("Error processing command")
-            return f"Error: {str(e)}"
+        outputs = self.execute((line,))
+        return outputs[0] if outputs else ""
+
+    def run_batch(self, source, out, chunk_size: int = 1 << 20):
+        """Stream commands from source in large chunks, writing outputs to out.
+
+        Each chunk's outputs go out in a single write, so replaying a long
+        command file costs parsing and dispatch, not per-line I/O.
+        """
+        carry = ""
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            lines = (carry + chunk).split("\n")
+            carry = lines.pop()
+            outputs = self.execute(lines)
+            if outputs:
+                out.write("\n".join(outputs) + "\n")
+        outputs = self.execute((carry,))
+        if outputs:
+            out.write("\n".join(outputs) + "\n")
+        if self.wal is not None:
+            self.wal.sync()
+        out.flush()
 
 def main():
+
+    # Configure output only when run as a program; importing the module must not
+    # install handlers or turn on DEBUG for the whole process
+    logging.basicConfig(
+        level=os.environ.get("DATA_STORE_LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler()]
+    )
     store = CountingStore()
-    for line in sys.stdin:
-        store.process_command(line)
-        # print(line)
-        print(store.checkpoints)
-        print(store.store)
+    store.run_batch(sys.stdin, sys.stdout)
 
 def test_from_file():
     store = CountingStore()
@@ -77,6 +77,57 @@ class TestCountingStore(unittest.TestCase):
         result = self.run_script(cmds)
         self.assertEqual(result, expected)
     
+    def test_countrange_and_topvalues_follow_reverts(self):
+        cmds = [
+            "WRITE a 10",
+            "WRITE b 20",
+            "WRITE c 20",
+            "WRITE d 30",
+            "COUNTRANGE 15 30",
+            "TOPVALUES 2",
+            "CHECKPOINT",
+            "WRITE a 30",
+            "WRITE b 30",
+            "COUNTRANGE 15 25",
+            "TOPVALUES 5",
+            "REVERT",
+            "COUNTRANGE 15 25",
+            "COUNTRANGE 30 10",
+            "TOPVALUES 1",
+            "TOPVALUES 0",
+        ]
+        expected = ["3", "20:2 10:1", "1", "30:3 20:1", "2", "0", "20:2", "No values"]
+        result = self.run_script(cmds)
+        self.assertEqual(result, expected)
+
+    def test_value_index_levels_stay_logarithmic(self):
+        for i in range(1000):
+            self.store.write(f"k{i}", i)
+            self.assertEqual(self.store.countrange(0, i), i + 1)  # one fresh value per fold
+        sizes = [len(values) for values, _ in self.store.value_index.levels]
+        self.assertLessEqual(len(sizes), 11)
+        self.assertEqual(sum(sizes), 1000)
+        self.assertEqual(self.store.topvalues(2), [(0, 1), (1, 1)])
+
+    def test_checkpoint_keeps_first_old_value_per_key(self):
+        self.run_script(["WRITE a 1", "CHECKPOINT"])
+        for value in range(100):
+            self.store.write("a", value)
+            self.store.write("b", value)
+        self.assertEqual(self.store.checkpoints, [{"a": 1, "b": None}])
+        self.assertEqual(self.run_script(["REVERT", "READ a", "READ b", "COUNTVAL 1", "COUNTVAL 99"]),
+                         ["1", "No value", "1", "0"])
+
+    def test_load_converts_legacy_undo_lists(self):
+        import json, os, tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "legacy.json")
+            with open(filename, "w") as f:
+                json.dump({"store": {"a": 3}, "value_count": {"3": 1},
+                           "checkpoints": [[["WRITE", "a", 1], ["WRITE", "a", 2]]]}, f)
+            self.run_script([f"LOAD {filename}", "REVERT"])
+        self.assertEqual(self.store.read("a"), "1")
+
     def test_save_load(self):
         import os
         filename = "temp_test_state.json"
@@ -105,6 +156,86 @@ class TestCountingStore(unittest.TestCase):
             os.remove(filename)
 
 
+    def test_wal_recovers_after_restart(self):
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as wal_dir:
+            store = CountingStore(wal_dir=wal_dir)
+            self.store = store
+            self.run_script([
+                "WRITE a 1",
+                "CHECKPOINT",
+                "WRITE a 2",
+                "WRITE b 2",
+                "CHECKPOINT",
+                "WRITE a 3",
+                "REVERT",
+                "SAVE",
+            ])
+            store.close()
+
+            self.store = CountingStore(wal_dir=wal_dir)
+            self.assertEqual(self.run_script(["READ a", "COUNTVAL 2", "REVERT", "READ a", "READ b"]),
+                             ["2", "2", "1", "No value"])
+            self.store.close()
+
+    def test_wal_survives_process_death_while_idle(self):
+        import os, subprocess, sys, tempfile, textwrap
+        with tempfile.TemporaryDirectory() as wal_dir:
+            child = textwrap.dedent(f"""
+                import os, time
+                from data_store import CountingStore
+                store = CountingStore(wal_dir={wal_dir!r}, sync_interval=0.05)
+                for i in range(10):
+                    store.process_command(f"WRITE k{{i}} {{i}}")
+                time.sleep(0.5)
+                assert store.wal.synced == store.wal.written  # the flusher fsynced while idle
+                os._exit(0)
+            """)
+            subprocess.run([sys.executable, "-c", child], cwd=os.path.dirname(os.path.abspath(__file__)),
+                           check=True, stdin=subprocess.DEVNULL, capture_output=True)
+            recovered = CountingStore(wal_dir=wal_dir)
+            self.assertEqual(len(recovered.store), 10)
+            self.assertEqual(recovered.read("k9"), "9")
+            recovered.close()
+
+    def test_wal_compaction_and_torn_tail(self):
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as wal_dir:
+            store = CountingStore(wal_dir=wal_dir, compact_every=100)
+            for i in range(250):
+                store.write(f"k{i % 50}", i)
+            store.checkpoint()
+            store.write("k0", -1)
+            store.close()
+            self.assertIn("snapshot.json", os.listdir(wal_dir))
+            logs = sorted(name for name in os.listdir(wal_dir) if name.endswith(".log"))
+            self.assertEqual(len(logs), 1)  # folded generations are deleted
+
+            with open(os.path.join(wal_dir, logs[0]), "ab") as f:
+                f.write(b"\x01\x02\x03")  # partial record from a crash
+            recovered = CountingStore(wal_dir=wal_dir)
+            self.assertEqual(recovered.store, store.store)
+            self.assertEqual(recovered.countval(-1), 1)
+            recovered.revert()
+            self.assertEqual(recovered.read("k0"), "200")
+            recovered.close()
+
+    def test_tracing_is_gated(self):
+        self.assertFalse(self.store.trace)  # importing data_store leaves DEBUG off
+        self.store.trace = True
+        with self.assertLogs("data_store", level="DEBUG") as logs:
+            self.run_script(["WRITE a 1", "READ a"])
+        self.assertEqual(logs.output, ["DEBUG:data_store:WRITE: a = 1 (old: None)",
+                                       "DEBUG:data_store:READ: a => 1"])
+
+    def test_run_batch_streams_across_chunks(self):
+        import io
+        source = io.StringIO("write a 1\nWRITE b 1\n\nCOUNTVAL 1\nCHECKPOINT\nWRITE a 2\nREAD a\nREVERT\nREAD a\nBOGUS\nREAD")
+        out = io.StringIO()
+        self.store.run_batch(source, out, chunk_size=7)  # splits most lines mid-token
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["2", "2", "1", "Invalid command", "Error: list index out of range"])
+
     def test_script_file(self):
         import os
 